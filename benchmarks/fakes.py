@@ -0,0 +1,269 @@
+"""
+Offline stand-ins used by the load tests: a recording fake of the Pyrogram Client, fake
+messages/callback queries for driving the real handlers, and a local aiohttp server that
+yt-dlp downloads synthetic media from.
+"""
+import os
+import time
+import random
+import asyncio
+import threading
+import itertools
+from collections import Counter, defaultdict
+from types import SimpleNamespace
+
+from aiohttp import web
+from pyrogram.errors import FloodWait, MessageIdInvalid, MessageNotModified, UserIsBlocked
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.mention = f"[user{user_id}](tg://user?id={user_id})"
+
+
+class FakeMessage:
+    """Enough of pyrogram's Message for the handlers: reply/edit/delete route back through the fake client."""
+    def __init__(self, client, chat_id, message_id, text=None, reply_markup=None, video=None, from_user=None):
+        self._client = client
+        self.id = message_id
+        self.chat = SimpleNamespace(id=chat_id)
+        self.from_user = from_user or FakeUser(chat_id)
+        self.text = text
+        self.reply_markup = reply_markup
+        self.video = video
+        self.empty = self.deleted = False
+
+    @property
+    def buttons(self):
+        if not self.reply_markup: return []
+        return [button.callback_data for row in self.reply_markup.inline_keyboard for button in row]
+
+    async def reply_text(self, text, quote=None, reply_markup=None, **kwargs):
+        return await self._client.send_message(self.chat.id, text, reply_markup=reply_markup)
+
+    async def edit_text(self, text, reply_markup=None, **kwargs):
+        return await self._client.edit_message_text(self.chat.id, self.id, text, reply_markup=reply_markup)
+
+    async def delete(self):
+        return await self._client.delete_messages(self.chat.id, self.id)
+
+
+class FakeCallbackQuery:
+    def __init__(self, client, user_id, data, message):
+        self._client = client
+        self.from_user = FakeUser(user_id)
+        self.data, self.message = data, message
+
+    async def answer(self, text=None, show_alert=None, **kwargs):
+        await self._client._call("answer_callback_query", self.from_user.id)
+
+
+class FakeClient:
+    """
+    Records every outgoing API call and answers it like Telegram would after `latency` seconds.
+    With probability `flood_rate` a send/edit/copy raises FloodWait(`flood_wait`) instead, and
+    chats in `blocked` raise UserIsBlocked. Uploads of local files are paced at `upload_rate`
+    bytes/s with progress callbacks, like pyrogram's.
+
+    Every message sent or edited in a chat is appended to that chat's event log, so drivers can
+    mark() a position and wait_for() the first later event matching a predicate.
+    """
+    FLOODABLE = {"send_message", "send_photo", "send_video", "edit_message_text", "copy_message"}
+
+    def __init__(self, latency=0.0, flood_rate=0.0, flood_wait=1, upload_rate=50 * 1024 * 1024, blocked=(), seed=None):
+        self.latency, self.flood_rate, self.flood_wait, self.upload_rate = latency, flood_rate, flood_wait, upload_rate
+        self.blocked = set(blocked)
+        self.calls, self.flood_waits = Counter(), Counter()
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._messages = {}
+        self._events = defaultdict(list)         # chat_id -> [(method, message)]
+        self._waiters = defaultdict(list)        # chat_id -> [(predicate, future)]
+
+    # --- Recording --- #
+    async def _call(self, method, chat_id):
+        self.calls[method] += 1
+        if self.latency: await asyncio.sleep(self.latency)
+        if method in self.FLOODABLE and self.flood_rate and self._random.random() < self.flood_rate:
+            self.flood_waits[method] += 1
+            raise FloodWait(value=self.flood_wait)
+
+    def _emit(self, chat_id, method, message):
+        self._events[chat_id].append((method, message))
+        waiters = self._waiters[chat_id]
+        for waiter in waiters[:]:
+            predicate, future = waiter
+            if not future.done() and predicate(method, message):
+                future.set_result((method, message))
+                waiters.remove(waiter)
+
+    def _new_message(self, chat_id, method, **kwargs):
+        message = FakeMessage(self, chat_id, next(self._ids), **kwargs)
+        self._messages[(chat_id, message.id)] = message
+        self._emit(chat_id, method, message)
+        return message
+
+    def incoming(self, chat_id, text):
+        """A message from the user, as the handlers would receive it (not recorded as an API call)."""
+        message = FakeMessage(self, chat_id, next(self._ids), text=text)
+        self._messages[(chat_id, message.id)] = message
+        return message
+
+    def mark(self, chat_id):
+        return len(self._events[chat_id])
+
+    async def wait_for(self, chat_id, predicate, since=0, timeout=None):
+        """First (method, message) event in `chat_id` at or after `since` that matches predicate."""
+        for method, message in self._events[chat_id][since:]:
+            if predicate(method, message): return method, message
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[chat_id].append((predicate, future))
+        return await asyncio.wait_for(future, timeout)
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    # --- Client API used by bot.py --- #
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        await self._call("send_message", chat_id)
+        if chat_id in self.blocked: raise UserIsBlocked()
+        return self._new_message(chat_id, "send_message", text=text, reply_markup=reply_markup)
+
+    async def send_photo(self, chat_id, photo, caption=None, reply_markup=None, **kwargs):
+        await self._call("send_photo", chat_id)
+        return self._new_message(chat_id, "send_photo", text=caption, reply_markup=reply_markup)
+
+    async def send_video(self, chat_id, video, caption=None, progress=None, **kwargs):
+        await self._call("send_video", chat_id)
+        if os.path.isfile(video):
+            total = os.path.getsize(video)
+            chunk, sent, started = 512 * 1024, 0, time.monotonic()
+            while sent < total:
+                sent = min(total, sent + chunk)
+                delay = started + sent / self.upload_rate - time.monotonic()
+                if delay > 0: await asyncio.sleep(delay)
+                if progress:
+                    result = progress(sent, total)
+                    if asyncio.iscoroutine(result): await result
+            video_info = SimpleNamespace(file_id=f"fake-file-{next(self._file_ids)}", file_size=total, reused=False)
+        else:
+            video_info = SimpleNamespace(file_id=video, file_size=0, reused=True)
+        return self._new_message(chat_id, "send_video", text=caption, video=video_info)
+
+    async def edit_message_text(self, chat_id, message_id, text, reply_markup=None, **kwargs):
+        await self._call("edit_message_text", chat_id)
+        message = self._messages.get((chat_id, message_id))
+        if message is None: raise MessageIdInvalid()
+        if message.text == text and message.reply_markup == reply_markup: raise MessageNotModified()
+        message.text, message.reply_markup = text, reply_markup
+        self._emit(chat_id, "edit_message_text", message)
+        return message
+
+    async def delete_messages(self, chat_id, message_ids, **kwargs):
+        await self._call("delete_messages", chat_id)
+        for message_id in message_ids if isinstance(message_ids, (list, tuple)) else [message_ids]:
+            message = self._messages.pop((chat_id, message_id), None)
+            if message: message.deleted = True
+        return True
+
+    async def copy_message(self, chat_id, from_chat_id, message_id, **kwargs):
+        await self._call("copy_message", chat_id)
+        if chat_id in self.blocked: raise UserIsBlocked()
+        return self._new_message(chat_id, "copy_message", text=f"copy of {from_chat_id}/{message_id}")
+
+    async def get_messages(self, chat_id, message_ids, **kwargs):
+        await self._call("get_messages", chat_id)
+        message = self._messages.get((chat_id, message_ids))
+        if message is None:
+            message = FakeMessage(self, chat_id, message_ids)
+            message.empty = True
+        return message
+
+    async def send_document(self, chat_id, document, caption=None, **kwargs):
+        await self._call("send_document", chat_id)
+        return self._new_message(chat_id, "send_document", text=caption)
+
+
+class SyntheticMediaServer:
+    """
+    Serves /media/<name>.mp4 as `size` bytes of filler at `rate` bytes/s per connection. yt-dlp's
+    generic extractor treats a video/mp4 response as a direct download, so the bot's real
+    extraction, download and resume paths run against it. Range requests are honoured.
+    """
+    CHUNK = 64 * 1024
+
+    def __init__(self, size=4 * 1024 * 1024, rate=20 * 1024 * 1024, host="127.0.0.1"):
+        self.size, self.rate, self.host = size, rate, host
+        self.port = None
+        self.requests = self.bytes_sent = 0
+        self._runner = self._loop = self._thread = None
+
+    def start(self):
+        """Starts serving on a background thread with its own event loop, so the bot's loop only sees client-side work."""
+        ready = threading.Event()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self._setup())
+            ready.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self._runner.cleanup())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=serve, name="synthetic-media", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    async def _setup(self):
+        app = web.Application()
+        app.router.add_route("*", "/media/{name}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def stop(self):
+        if self._thread:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._thread = None
+
+    def url(self, name):
+        return f"http://{self.host}:{self.port}/media/{name}.mp4"
+
+    async def _handle(self, request):
+        self.requests += 1
+        start, end = 0, self.size - 1
+        headers = {"Content-Type": "video/mp4", "Accept-Ranges": "bytes"}
+        byte_range = request.headers.get("Range", "")
+        if byte_range.startswith("bytes="):
+            first, _, last = byte_range[6:].partition("-")
+            start = int(first or 0)
+            end = min(int(last), end) if last else end
+            headers["Content-Range"] = f"bytes {start}-{end}/{self.size}"
+        headers["Content-Length"] = str(end - start + 1)
+        response = web.StreamResponse(status=206 if byte_range else 200, headers=headers)
+        await response.prepare(request)
+        if request.method == "HEAD": return response
+
+        block, sent, started = b"\0" * self.CHUNK, 0, time.monotonic()
+        remaining = end - start + 1
+        try:
+            while remaining > 0:
+                n = min(self.CHUNK, remaining)
+                await response.write(block[:n])
+                sent += n
+                remaining -= n
+                delay = started + sent / self.rate - time.monotonic()
+                if delay > 0: await asyncio.sleep(delay)
+            await response.write_eof()
+        except ConnectionResetError:
+            pass  # yt-dlp's generic extractor hangs up once it has seen the headers.
+        finally:
+            self.bytes_sent += sent
+        return response
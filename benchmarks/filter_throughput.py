@@ -0,0 +1,85 @@
+"""
+Microbenchmark: messages/sec through bot.verified_user_filter.
+
+Compares the legacy lookup (a fresh sqlite3.connect per call, run directly on the event
+loop) against the persistent async Database layer, using a throwaway database.
+
+    python benchmarks/filter_throughput.py --users 1000 --messages 20000 --concurrency 50
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import sqlite3
+import argparse
+import tempfile
+from types import SimpleNamespace
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+
+def legacy_get_user_status(db_file, user_id):
+    with sqlite3.connect(db_file) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT is_verified, is_banned FROM users WHERE user_id = ?", (user_id,))
+        result = cursor.fetchone()
+        return {"verified": bool(result[0]), "banned": bool(result[1])} if result else None
+
+
+def seed(db_file, users):
+    with sqlite3.connect(db_file) as conn:
+        conn.executemany("INSERT OR IGNORE INTO users (user_id, is_verified) VALUES (?, 1)", [(uid,) for uid in range(1, users + 1)])
+        conn.commit()
+
+
+async def drive(bot, users, messages, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    fake_messages = [SimpleNamespace(from_user=SimpleNamespace(id=random.randint(1, users))) for _ in range(messages)]
+
+    async def one(message):
+        async with semaphore:
+            assert await bot.verified_user_filter(None, message)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(m) for m in fake_messages))
+    return messages / (time.perf_counter() - started)
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="bench_filter_")
+    os.chdir(workdir)
+    import bot
+
+    bot.DB_FILE = os.path.join(workdir, "bench.db")
+    bot.init_db()
+    seed(bot.DB_FILE, args.users)
+
+    current_get_user_status = bot.get_user_status
+
+    async def legacy(user_id):
+        return legacy_get_user_status(bot.DB_FILE, user_id)
+
+    bot.get_user_status = legacy
+    before = await drive(bot, args.users, args.messages, args.concurrency)
+
+    bot.get_user_status = current_get_user_status
+    bot.db = bot.Database(bot.DB_FILE)
+    bot.db.open()
+    try:
+        after = await drive(bot, args.users, args.messages, args.concurrency)
+    finally:
+        bot.db.close()
+
+    print(f"users={args.users} messages={args.messages} concurrency={args.concurrency}")
+    print(f"before (sqlite3.connect per call): {before:10.0f} msg/s")
+    print(f"after  (persistent async layer):   {after:10.0f} msg/s  ({after / before:.2f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    asyncio.run(run(parser.parse_args()))
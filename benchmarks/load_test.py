@@ -0,0 +1,306 @@
+"""
+Offline load test: replays /start, link, confirm, cancel and broadcast traffic through bot.py's
+real handlers, with a fake Telegram client and synthetic media served from a local aiohttp
+server (see fakes.py). Reports messages/sec, job completion latency percentiles, event-loop
+lag and peak memory (bot process plus yt-dlp workers) for each phase.
+
+    python benchmarks/load_test.py --users 20 --links-per-user 2 --media-size 2M --media-rate 8M
+    python benchmarks/load_test.py --flood-rate 0.02 --cancel-rate 0.2 --executor thread
+    python benchmarks/load_test.py --broadcast-users 5000 --broadcast-rate 500 --blocked-rate 0.05
+"""
+import os
+import sys
+import math
+import time
+import random
+import asyncio
+import argparse
+import logging
+import tempfile
+from collections import Counter
+
+import psutil
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import FakeClient, FakeCallbackQuery, SyntheticMediaServer
+
+ADMIN_ID = 1
+FIRST_USER_ID = 1000
+BROADCAST_FIRST_USER_ID = 10 ** 6
+
+
+def parse_size(text):
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in units: return int(float(text[:-1]) * units[text[-1]])
+    return int(float(text))
+
+
+def percentile(samples, q):
+    if not samples: return 0.0
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+class Monitor:
+    """Samples event-loop lag continuously and peak RSS of this process and its children."""
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.lags, self.peak_rss = [], 0
+        self._process = psutil.Process()
+
+    def rss(self):
+        total = self._process.memory_info().rss
+        for child in self._process.children(recursive=True):
+            try: total += child.memory_info().rss
+            except psutil.Error: pass
+        return total
+
+    async def run(self):
+        ticks = 0
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.monotonic() - start - self.interval))
+            ticks += 1
+            if ticks % 10 == 0: self.peak_rss = max(self.peak_rss, self.rss())
+
+
+class Phase:
+    """Counts inbound updates, outbound API calls and handler errors over one phase of the run."""
+    def __init__(self, name, ctx):
+        self.name, self.ctx = name, ctx
+        self.updates, self.errors = 0, Counter()
+        self.latencies, self.outcomes = [], Counter()
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.calls_before = self.ctx.client.total_calls
+        self.lag_index = len(self.ctx.monitor.lags)
+        self.ctx.monitor.peak_rss = self.ctx.monitor.rss()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.started
+        self.calls = self.ctx.client.total_calls - self.calls_before
+        self.lags = self.ctx.monitor.lags[self.lag_index:]
+        self.peak_rss = max(self.ctx.monitor.peak_rss, self.ctx.monitor.rss())
+
+    async def dispatch(self, handler, *args):
+        """Runs one handler like pyrogram's dispatcher would: errors are counted, not raised."""
+        self.updates += 1
+        try: await handler(*args)
+        except Exception as e: self.errors[type(e).__name__] += 1
+
+    def report(self):
+        ms = lambda seconds: f"{seconds * 1000:.1f}ms"
+        print(f"\n== {self.name} ({self.elapsed:.1f}s) ==")
+        print(f"inbound updates: {self.updates:8d}  ({self.updates / self.elapsed:10.1f} msg/s)")
+        print(f"outbound calls:  {self.calls:8d}  ({self.calls / self.elapsed:10.1f} calls/s)")
+        if self.latencies:
+            print(
+                f"job latency:     p50 {percentile(self.latencies, 0.5):.2f}s  p90 {percentile(self.latencies, 0.9):.2f}s  "
+                f"p99 {percentile(self.latencies, 0.99):.2f}s  max {max(self.latencies):.2f}s"
+            )
+        if self.outcomes: print(f"outcomes:        {dict(self.outcomes)}")
+        if self.errors: print(f"handler errors:  {dict(self.errors)}")
+        lag_max = max(self.lags, default=0.0)
+        print(f"loop lag:        p50 {ms(percentile(self.lags, 0.5))}  p99 {ms(percentile(self.lags, 0.99))}  max {ms(lag_max)}")
+        print(f"peak memory:     {self.peak_rss / 1024 ** 2:.1f} MB (bot + workers)")
+
+
+class Context:
+    def __init__(self, bot, client, server, monitor, args):
+        self.bot, self.client, self.server, self.monitor, self.args = bot, client, server, monitor, args
+        self.random = random.Random(args.seed)
+
+
+async def start_storm(ctx):
+    """Many users sending /start at once; the first /start for each user also registers them."""
+    bot, client, args = ctx.bot, ctx.client, ctx.args
+    semaphore = asyncio.Semaphore(args.concurrency)
+    user_ids = [FIRST_USER_ID + i for i in range(args.users)]
+
+    async def one(n):
+        async with semaphore:
+            await phase.dispatch(bot.start_command, client, client.incoming(user_ids[n % len(user_ids)], "/start"))
+
+    with Phase("/start storm", ctx) as phase:
+        await asyncio.gather(*(one(n) for n in range(args.start_messages)))
+        await asyncio.gather(*(
+            phase.dispatch(bot.age_verification_callback, client, FakeCallbackQuery(client, user_id, "verify_age_yes", client.incoming(user_id, "")))
+            for user_id in user_ids
+        ))
+    return phase
+
+
+def has_button(prefix):
+    return lambda method, message: any(data.startswith(prefix) for data in message.buttons)
+
+
+def is_final(method, message):
+    if method == "send_video": return True
+    return bool(message.text) and message.text.startswith(("❌ **Download Canceled**", "🚫"))
+
+
+def outcome_of(method, message):
+    if method == "send_video": return "reused" if message.video.reused else "delivered"
+    return "cancelled" if message.text.startswith("❌") else "failed"
+
+
+async def user_session(ctx, phase, user_id):
+    bot, client, args = ctx.bot, ctx.client, ctx.args
+    for _ in range(args.links_per_user):
+        link = ctx.server.url(f"clip{ctx.random.randrange(args.distinct_media)}")
+        message = client.incoming(user_id, link)
+        mark = client.mark(user_id)
+        if not await bot.verified_user_filter(client, message):
+            phase.outcomes["filtered"] += 1
+            continue
+        if not await bot.admission_filter(client, message):
+            phase.outcomes["rate_limited"] += 1
+            continue
+        await phase.dispatch(bot.link_handler, client, message)
+        try:
+            _, preview = await client.wait_for(user_id, lambda m, msg: has_button("confirm_")(m, msg) or is_final(m, msg), since=mark, timeout=args.job_timeout)
+        except asyncio.TimeoutError:
+            phase.outcomes["no_preview"] += 1
+            continue
+        if not has_button("confirm_")(None, preview):
+            phase.outcomes["rejected"] += 1
+            continue
+
+        confirm = next(data for data in preview.buttons if data.startswith("confirm_"))
+        mark, started = client.mark(user_id), time.perf_counter()
+        await phase.dispatch(bot.confirmation_callback, client, FakeCallbackQuery(client, user_id, confirm, preview))
+        canceller = None
+        if ctx.random.random() < args.cancel_rate:
+            canceller = asyncio.ensure_future(cancel_later(ctx, phase, user_id, mark))
+        try:
+            method, final = await client.wait_for(user_id, is_final, since=mark, timeout=args.job_timeout)
+            phase.outcomes[outcome_of(method, final)] += 1
+            if method == "send_video": phase.latencies.append(time.perf_counter() - started)
+        except asyncio.TimeoutError:
+            phase.outcomes["timeout"] += 1
+        if canceller: canceller.cancel()
+
+
+async def cancel_later(ctx, phase, user_id, mark):
+    await asyncio.sleep(ctx.random.uniform(0, ctx.args.cancel_after))
+    _, status = await ctx.client.wait_for(user_id, has_button("cancel_dl_"), since=mark)
+    data = next(data for data in status.buttons if data.startswith("cancel_dl_"))
+    await phase.dispatch(ctx.bot.cancel_download_handler, ctx.client, FakeCallbackQuery(ctx.client, user_id, data, status))
+
+
+async def job_flow(ctx):
+    """Each user sends links one after another: preview, confirm, optionally cancel, wait for the result."""
+    with Phase("link -> confirm -> download/upload", ctx) as phase:
+        await asyncio.gather(*(user_session(ctx, phase, FIRST_USER_ID + i) for i in range(ctx.args.users)))
+        # Users see their video before the job's bookkeeping is done; wait for the queue to drain too.
+        deadline = time.monotonic() + ctx.args.job_timeout
+        while await ctx.bot.db.fetchval("SELECT COUNT(*) FROM jobs") and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+    return phase
+
+
+async def broadcast(ctx):
+    """One admin broadcast to every user (plus the synthetic recipients seeded here)."""
+    bot, client, args = ctx.bot, ctx.client, ctx.args
+    recipients = [BROADCAST_FIRST_USER_ID + i for i in range(args.broadcast_users)]
+    await bot.db.executemany("INSERT OR IGNORE INTO users (user_id, is_verified) VALUES (?, 1)", [(user_id,) for user_id in recipients])
+    client.blocked.update(user_id for user_id in recipients if ctx.random.random() < args.blocked_rate)
+    if args.broadcast_rate: bot.broadcast_engine.bucket = bot.TokenBucket(args.broadcast_rate, args.broadcast_rate)
+
+    with Phase("broadcast", ctx) as phase:
+        bot.admin_states[ADMIN_ID] = "broadcast"
+        mark = client.mark(ADMIN_ID)
+        await phase.dispatch(bot.admin_action_handler, client, client.incoming(ADMIN_ID, "📣 load test"))
+        done = lambda method, message: bool(message.text) and message.text.startswith(("✅ **Broadcast Complete", "🛑"))
+        _, summary = await client.wait_for(ADMIN_ID, done, since=mark)
+        phase.outcomes.update(copied=client.calls["copy_message"], blocked=len(client.blocked))
+        print(summary.text.replace("\n", " "))
+    return phase
+
+
+def print_stage_latency(bot):
+    print("\n== bot-side stage latency (avg / p95 bucket) ==")
+    for stage in ("extract", "queue", "download", "merge", "thumbnail", "upload"):
+        count, mean, p95 = bot.metrics.summary("bot_stage_seconds", stage=stage)
+        if count: print(f"{stage:10s} {mean:8.3f}s / <={p95:g}s  (n={count})")
+    count, mean, p95 = bot.metrics.summary("bot_db_seconds")
+    print(f"{'db':10s} {mean * 1000:8.2f}ms / <={p95 * 1000:g}ms  (n={count})")
+    print(f"status edits: {bot.status_updates.edits}  skipped: {bot.status_updates.skipped}  flood waits: {bot.status_updates.flood_waits}")
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="bench_load_")
+    os.chdir(workdir)
+    import bot
+    if not args.verbose: logging.getLogger().setLevel(logging.WARNING)
+
+    client = FakeClient(latency=args.api_latency, flood_rate=args.flood_rate, flood_wait=args.flood_wait, upload_rate=args.upload_rate, seed=args.seed)
+    bot.app = client
+    bot.ADMINS[:] = [ADMIN_ID]
+    bot.BOT_IS_ACTIVE = True
+    bot.SELF_DESTRUCT_TIMER = 0
+    bot.storage.min_free = 0
+    bot.ytdlp_executor = bot.ProcessExecutor(args.workers) if args.executor == "process" else bot.ThreadExecutor()
+    for directory in bot.storage.dirs: os.makedirs(directory, exist_ok=True)
+    bot.init_db()
+    bot.db.open()
+
+    server = SyntheticMediaServer(size=args.media_size, rate=args.media_rate).start()
+    monitor = Monitor()
+    monitor_task = asyncio.create_task(monitor.run())
+    bot.status_updates.start()
+    await bot.scheduler.start()
+    await bot.broadcast_engine.start()
+    ctx = Context(bot, client, server, monitor, args)
+
+    print(
+        f"users={args.users} links/user={args.links_per_user} distinct media={args.distinct_media} "
+        f"media={args.media_size / 1024 ** 2:.1f}MB @ {args.media_rate / 1024 ** 2:.1f}MB/s executor={args.executor} "
+        f"api latency={args.api_latency * 1000:.0f}ms flood rate={args.flood_rate}"
+    )
+    try:
+        phases = [await start_storm(ctx), await job_flow(ctx)]
+        if args.broadcast_users: phases.append(await broadcast(ctx))
+    finally:
+        monitor_task.cancel()
+        await bot.ytdlp_executor.shutdown()
+        await bot.close_http_session()
+        server.stop()
+        bot.db.close()
+
+    for phase in phases: phase.report()
+    print_stage_latency(bot)
+    print(f"\nFloodWaits injected: {dict(client.flood_waits)}  media requests served: {server.requests}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--start-messages", type=int, default=2000, help="/start messages in the first phase")
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent /start handlers")
+    parser.add_argument("--links-per-user", type=int, default=2)
+    parser.add_argument("--distinct-media", type=int, default=20, help="size of the link pool; repeats exercise the file_id cache")
+    parser.add_argument("--cancel-rate", type=float, default=0.1, help="fraction of confirmed jobs cancelled mid-flight")
+    parser.add_argument("--cancel-after", type=float, default=2.0, help="max seconds before a cancel is sent")
+    parser.add_argument("--job-timeout", type=float, default=300)
+    parser.add_argument("--media-size", type=parse_size, default=parse_size("2M"))
+    parser.add_argument("--media-rate", type=parse_size, default=parse_size("8M"), help="bytes/s per download connection")
+    parser.add_argument("--upload-rate", type=parse_size, default=parse_size("20M"), help="bytes/s per fake upload")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="seconds per fake Telegram API call")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="probability a send/edit/copy raises FloodWait")
+    parser.add_argument("--flood-wait", type=int, default=1)
+    parser.add_argument("--broadcast-users", type=int, default=250, help="synthetic broadcast recipients; 0 skips the phase")
+    parser.add_argument("--broadcast-rate", type=float, default=0, help="override BROADCAST_RATE (msgs/s)")
+    parser.add_argument("--blocked-rate", type=float, default=0.02)
+    parser.add_argument("--executor", choices=("process", "thread"), default="process")
+    parser.add_argument("--workers", type=int, default=4, help="yt-dlp worker processes")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="keep the bot's INFO logging on the console")
+    asyncio.run(run(parser.parse_args()))
@@ -1,17 +1,45 @@
 import os
+import sys
 import time
+IMPORT_STARTED = time.perf_counter()
 import math
 import asyncio
-import aiohttp
-import yt_dlp
+import importlib
 import logging
 import traceback
-import psutil
 import sqlite3
+import shutil
+import hashlib
+import glob
+import signal
+import multiprocessing
+import threading
+import socket
+import uuid
+import bisect
+import contextvars
+from collections import OrderedDict, defaultdict, deque, namedtuple
+from dataclasses import dataclass, field
+import queue
+from contextlib import contextmanager, nullcontext
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
 from logging.handlers import RotatingFileHandler
 from pyrogram import Client, filters, idle
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message
-from pyrogram.errors import FloodWait, MessageNotModified, UserIsBlocked, InputUserDeactivated
+from pyrogram.errors import FloodWait, MessageNotModified, UserIsBlocked, InputUserDeactivated, UserDeactivated, UserDeactivatedBan, PeerIdInvalid
+
+class LazyModule:
+    """Stands in for a heavy module and imports it on first attribute access, keeping it off the startup path."""
+    def __init__(self, name):
+        self._name, self._module = name, None
+
+    def __getattr__(self, attr):
+        if self._module is None: self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+# yt-dlp alone pulls in hundreds of modules; these load on first use or during the post-start warm-up.
+yt_dlp, psutil, aiohttp, web = (LazyModule(name) for name in ("yt_dlp", "psutil", "aiohttp", "aiohttp.web"))
 
 # ================================= CONFIG ================================= #
 # --- Critical Settings ---
@@ -20,37 +48,351 @@ API_ID = int(os.environ.get("API_ID", 0))
 API_HASH = os.environ.get("API_HASH")
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
 
+# --- Process Mode ---
+# "standalone" (default) does everything in one process. "frontend" (`--frontend`) only handles updates and
+# queues jobs in the shared DB; any number of "worker" processes (`--worker`) on the same host claim and run
+# them, each uploading through its own session. All of them must share one SQLite file (and the downloads
+# directory), so split mode is single-host only: start them under one process manager (`honcho -f Procfile.split start`).
+# Don't run a standalone bot against a DB that workers use.
+BOT_MODE = "worker" if "--worker" in sys.argv else "frontend" if "--frontend" in sys.argv else os.environ.get("BOT_MODE", "standalone")
+# Names a worker's Pyrogram session and its job leases; set a stable WORKER_ID per worker to keep its session across restarts.
+WORKER_ID = os.environ.get("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
 # --- Admin & Paths ---
 # ادمین‌ها به صورت یک رشته با کاما از متغیرهای محیطی خوانده می‌شوند
 ADMINS_RAW = os.environ.get("ADMINS", "").split(',')
 ADMINS = [int(admin_id) for admin_id in ADMINS_RAW if admin_id.strip().isdigit()]
+TRUSTED_USERS = [int(user_id) for user_id in os.environ.get("TRUSTED_USERS", "").split(',') if user_id.strip().isdigit()]
 
 DOWNLOAD_PATH = "downloads/"
 LOG_PATH = "logs/"
+THUMB_CACHE_PATH = "thumbs/"
+SCRATCH_PATH = ""  # Optional fast directory (e.g. "/dev/shm/downloads/") for small jobs. Empty to disable.
 DB_FILE = "bot_database.db"
+DB_READER_THREADS = 4   # Reader connections serving SELECTs off the event loop.
+DB_WRITE_BATCH = 256    # Max queued writes committed together in one transaction.
+USER_CACHE_SIZE = 10000 # Users whose verified/banned flags are kept in memory.
+USER_CACHE_TTL = 3600   # Seconds before a cached user status is re-read from the DB.
 
 # --- Bot Behavior ---
-MAX_CONCURRENT_DOWNLOADS = 3
+MAX_CONCURRENT_DOWNLOADS = 3    # Download-stage worker slots.
+MAX_CONCURRENT_UPLOADS = 2      # Upload-stage worker slots; uploads overlap with other jobs' downloads.
+MAX_ACTIVE_JOBS_PER_USER = 1    # Running jobs per user; the rest wait their round-robin turn.
+QUEUE_POSITION_REFRESH = 1.5    # Seconds to coalesce queue changes before editing position messages.
+QUEUE_POSITION_EXACT = 10       # Front positions edited on every move; further back, only when crossing a multiple of this.
+STATUS_EDIT_RATE = 20           # Status-message edits/second across all jobs and broadcasts.
+STATUS_EDIT_INTERVAL = 3        # Minimum seconds between edits of the same progress message.
+STATUS_TICK = 1                 # Seconds between passes of the status-update loop.
+BROADCAST_RATE = 25             # Messages/second across all broadcasts (Telegram allows ~30/s for bots).
+BROADCAST_CONCURRENCY = 8       # Concurrent senders per broadcast.
+BROADCAST_PAGE_SIZE = 500       # Recipients fetched from the DB per page.
+BROADCAST_PROGRESS_INTERVAL = 5 # Seconds between checkpoints / progress edits.
+JOB_MAX_RETRIES = 5             # Re-queues after a transient download failure before giving up.
+JOB_RETRY_BACKOFF = 15          # Seconds before the first retry; doubles with each attempt.
+JOB_CHECKPOINT_INTERVAL = 10    # Seconds between saving running jobs' progress to the DB.
+JOB_LEASE_DURATION = 60         # Split mode: seconds a claimed job stays a worker's without a heartbeat.
+JOB_HEARTBEAT_INTERVAL = 15     # Split mode: seconds between a worker's lease renewals / progress checkpoints.
+WORKER_POLL_INTERVAL = 2        # Split mode: seconds between checks for new jobs and cancel requests.
+JOB_OUTCOME_RETENTION = 3600    # Split mode: seconds a finished job's row keeps its outcome for the front end.
+DOWNLOAD_RETRIES = 10           # yt-dlp's own in-attempt retries for requests and fragments.
+USER_RATE_LIMITS = {            # Per-tier link admission (admins are exempt): sustained rate, burst, previews extracting at once.
+    "default": {"per_minute": 6, "burst": 3, "extractions": 1},
+    "trusted": {"per_minute": 20, "burst": 8, "extractions": 3},  # Users listed in TRUSTED_USERS.
+}
+SLOW_DOWN_NOTICE_INTERVAL = 30  # Seconds between "slow down" replies to the same user; other rejected links are dropped silently.
+BATCH_MAX_ENTRIES = 100         # /batch: most playlist entries one batch downloads.
+BATCH_PAGE_SIZE = 25            # /batch: playlist entries listed per flat-extraction page.
+BATCH_LOOKAHEAD = 2             # /batch: entries of one batch queued or running at once; one downloads while another uploads.
+BATCH_BYTES_PER_SECOND = 320 * 1024  # /batch: assumed bytes per second of video (~2.5 Mbit/s, 720p) when estimating sizes.
 SELF_DESTRUCT_TIMER = 30  # Seconds before a sent video is deleted. 0 to disable.
+VIDEO_FORMAT = 'bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]/best[height<=720][ext=mp4]/best'  # Used when sizes can't be planned.
+MAX_VIDEO_HEIGHT = 720
+MAX_DOWNLOAD_SIZE = 1536 * 1024 * 1024      # Byte budget per video when planning formats.
+TELEGRAM_UPLOAD_LIMIT = 2000 * 1024 * 1024  # Largest file a bot can send; caps the budget above.
+MEDIA_CACHE_MAX_ENTRIES = 5000          # Uploaded file_ids kept for reuse (LRU beyond this).
+MEDIA_CACHE_MAX_AGE = 30 * 24 * 3600    # Seconds before a cached file_id is dropped.
+METADATA_CACHE_SIZE = 256   # Extracted info_dicts kept for reuse by later previews and the download stage.
+METADATA_CACHE_TTL = 900    # Seconds; kept short because extracted format URLs expire.
+CONFIRMATION_MAX_ENTRIES = 5000     # Pending "Confirm Download" cards kept in memory (oldest dropped first).
+CONFIRMATION_TTL = 6 * 3600         # Seconds before an unanswered card expires.
+CONFIRMATION_PERSIST = True         # Also keep pending cards in the DB so their buttons survive restarts.
+CONFIRMATION_SWEEP_INTERVAL = 600   # Seconds between sweeps of expired cards.
+
+# --- Storage ---
+STORAGE_QUOTA = 8 * 1024 ** 3                   # Bytes all running jobs may reserve together.
+STORAGE_MIN_FREE = 1024 ** 3                    # Free disk space always kept spare in DOWNLOAD_PATH.
+STORAGE_DEFAULT_RESERVATION = 512 * 1024 ** 2   # Reserved for a job whose size couldn't be estimated.
+SCRATCH_MAX_FILE = 256 * 1024 ** 2              # Largest job reservation placed in SCRATCH_PATH.
+STORAGE_SWEEP_INTERVAL = 1800                   # Seconds between orphaned-file sweeps.
+
+# --- HTTP & Thumbnails ---
+HTTP_POOL_SIZE = 32                         # Max open connections in the shared aiohttp session.
+HTTP_KEEPALIVE = 30                         # Seconds idle connections are kept for reuse.
+HTTP_DNS_CACHE_TTL = 300                    # Seconds resolved hostnames are cached.
+HTTP_TIMEOUT = 30                           # Total seconds per request.
+HTTP_CONNECT_TIMEOUT = 10
+THUMB_SIZE = 320                            # Telegram's max thumbnail width/height.
+THUMB_CACHE_MAX_BYTES = 200 * 1024 * 1024   # Thumbnail cache size before LRU eviction.
+
+# --- yt-dlp Execution ---
+YTDLP_EXECUTOR = "process"      # "process" (worker processes, instant cancel) or "thread".
+YTDLP_WORKER_PROCESSES = 4      # Worker processes shared by extractions and downloads.
+YTDLP_EXTRACT_RESERVED = 1      # Of those, workers downloads may never take, so previews don't queue behind them.
+WORKER_PROGRESS_INTERVAL = 0.5  # Seconds between progress messages a worker sends back.
+PRELOAD_EXTRACTORS = ("Youtube", "Generic")  # Extractors loaded (in every worker process) by the post-start warm-up.
+
+# --- Metrics ---
+METRICS_HOST = "127.0.0.1"      # Interface the Prometheus /metrics endpoint listens on.
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9100))  # 0 disables the endpoint; give each worker process its own.
+LOOP_LAG_INTERVAL = 0.5         # Seconds between event-loop lag probes.
 
 # ================================= LOGGING ================================= #
 os.makedirs(LOG_PATH, exist_ok=True)
-LOG_FILE = os.path.join(LOG_PATH, "bot.log")
+# Split-mode workers rotate their own file; two processes rotating one RotatingFileHandler file clobber each other.
+LOG_FILE = os.path.join(LOG_PATH, f"worker-{WORKER_ID}.log" if BOT_MODE == "worker" else "bot.log")
+# Trace id of the job (or preview) the current task is working on; tagged onto every log record.
+trace_id_var = contextvars.ContextVar("trace_id", default="-")
+
+def new_trace_id():
+    return uuid.uuid4().hex[:12]
+
+class TraceIdFilter(logging.Filter):
+    def filter(self, record):
+        record.trace_id = trace_id_var.get()
+        return True
+
+_log_handlers = [logging.StreamHandler()]
+# yt-dlp worker processes (spawned, so they re-run this module) log to the inherited stderr only. The process name
+# is already set when the re-run happens; parent_process() isn't yet.
+if multiprocessing.current_process().name == "MainProcess":
+    _log_handlers.insert(0, RotatingFileHandler(LOG_FILE, maxBytes=5 * 1024 * 1024, backupCount=2))
+for _handler in _log_handlers: _handler.addFilter(TraceIdFilter())
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        RotatingFileHandler(LOG_FILE, maxBytes=5 * 1024 * 1024, backupCount=2),
-        logging.StreamHandler()
-    ]
+    format='%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s',
+    handlers=_log_handlers
 )
 LOGGER = logging.getLogger(__name__)
 
+# ================================ METRICS ================================== #
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+class Metrics:
+    """
+    In-process registry of labelled counters and histograms, rendered in the Prometheus text
+    format. Observations may come from yt-dlp hooks and the DB threads, hence the lock.
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._meta = {}                     # name -> (type, help)
+        self._counters = defaultdict(float) # (name, labels) -> value
+        self._histograms = {}               # (name, labels) -> [bucket counts, sum, count]
+        self._gauges = {}                   # name -> callable returning the current value
+
+    def describe(self, name, kind, text):
+        self._meta[name] = (kind, text)
+
+    def gauge(self, name, text, fn):
+        self.describe(name, "gauge", text)
+        self._gauges[name] = fn
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock: self._counters[key] += value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None: histogram = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets): histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try: yield
+        finally: self.observe(name, time.perf_counter() - start, **labels)
+
+    def summary(self, name, **labels):
+        """(count, mean, approximate p95) of a histogram, merged across any labels not given."""
+        wanted = set(labels.items())
+        counts, total, count = [0] * len(self.buckets), 0.0, 0
+        with self._lock:
+            for (metric, key_labels), (bucket_counts, h_sum, h_count) in self._histograms.items():
+                if metric != name or not wanted <= set(key_labels): continue
+                counts = [a + b for a, b in zip(counts, bucket_counts)]
+                total += h_sum
+                count += h_count
+        if not count: return 0, 0.0, 0.0
+        target, seen, p95 = 0.95 * count, 0, self.buckets[-1]
+        for bound, bucket_count in zip(self.buckets, counts):
+            seen += bucket_count
+            if seen >= target:
+                p95 = bound
+                break
+        return count, total / count, p95
+
+    def total(self, name, **labels):
+        """Sum of a counter across any labels not given."""
+        wanted = set(labels.items())
+        with self._lock:
+            return sum(value for (metric, key_labels), value in self._counters.items() if metric == name and wanted <= set(key_labels))
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = [*labels, *extra]
+        if not pairs: return ""
+        escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+    def render(self):
+        lines, seen = [], set()
+
+        def header(name, default_kind):
+            if name in seen: return
+            seen.add(name)
+            kind, text = self._meta.get(name, (default_kind, ""))
+            if text: lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, ([*value[0]], value[1], value[2])) for key, value in self._histograms.items())
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{self._labels(labels)} {value:g}")
+        for (name, labels), (bucket_counts, h_sum, h_count) in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', f'{bound:g}')])} {cumulative}")
+            lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {h_count}")
+            lines.append(f"{name}_sum{self._labels(labels)} {h_sum:g}")
+            lines.append(f"{name}_count{self._labels(labels)} {h_count}")
+        for name, fn in self._gauges.items():
+            header(name, "gauge")
+            try: lines.append(f"{name} {fn():g}")
+            except Exception as e: LOGGER.warning(f"Gauge {name} failed: {e}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+metrics.describe("bot_stage_seconds", "histogram", "Latency of each pipeline stage (extract, queue, download, merge, thumbnail, upload).")
+metrics.describe("bot_db_seconds", "histogram", "Latency of database reads and writes, including time waiting for a DB thread.")
+metrics.describe("bot_event_loop_lag_seconds", "histogram", "How late the event loop ran a timer that should have fired on time.")
+metrics.describe("bot_bytes_total", "counter", "Media bytes moved, by direction; rate() gives throughput in bytes/s.")
+metrics.describe("bot_errors_total", "counter", "Pipeline failures by stage, exception type and extractor.")
+metrics.describe("bot_jobs_total", "counter", "Finished jobs by outcome.")
+metrics.describe("bot_admission_rejections_total", "counter", "Links dropped by per-user admission control, by reason (rate, extractions).")
+
+def error_type(e):
+    """Exception class name; worker-process errors carry the name of the original exception."""
+    return getattr(e, "kind", None) or type(e).__name__
+
+def extractor_of(media_key, link=None):
+    """Extractor name from a media key (`Extractor:id|format`), falling back to the link's host."""
+    if media_key and ":" in media_key: return media_key.split(":", 1)[0]
+    return (urlparse(link).hostname or "unknown") if link else "unknown"
+
+last_loop_lag = 0.0
+
+async def monitor_event_loop(interval=LOOP_LAG_INTERVAL):
+    """Measures how late a sleep wakes up; anything beyond a few ms means something is blocking the loop."""
+    global last_loop_lag
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        last_loop_lag = max(0.0, time.monotonic() - start - interval)
+        metrics.observe("bot_event_loop_lag_seconds", last_loop_lag)
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Serves /metrics for Prometheus. Returns the runner to clean up on shutdown, or None if disabled."""
+    if not port: return None
+    await asyncio.to_thread(importlib.import_module, "aiohttp.web")  # Import off the event loop.
+
+    async def handle_metrics(request):
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8", headers={"X-Content-Type-Options": "nosniff"})
+
+    web_app = web.Application()
+    web_app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(web_app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    LOGGER.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return runner
+
+# ================================ CACHING ================================== #
+_MISSING = object()
+
+class TTLCache:
+    """
+    Bounded LRU mapping whose entries also expire after `ttl` seconds.
+    invalidate() bumps `epoch`; a set() carrying an older epoch is dropped, so a read that
+    raced with a write can't put a stale value back after it was invalidated.
+    """
+    def __init__(self, maxsize, ttl):
+        self.maxsize, self.ttl = maxsize, ttl
+        self._data = OrderedDict()
+        self.hits = self.misses = self.evictions = self.expirations = self.epoch = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=_MISSING):
+        item = self._data.get(key)
+        if item is None or item[1] < time.monotonic():
+            if item is not None: del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def set(self, key, value, epoch=None):
+        if epoch is not None and epoch != self.epoch: return
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        """Removes a key, returning its value if it hadn't expired."""
+        item = self._data.pop(key, None)
+        return item[0] if item is not None and item[1] >= time.monotonic() else default
+
+    def invalidate(self, key):
+        self.epoch += 1
+        self._data.pop(key, None)
+
+    def purge_expired(self):
+        """Drops every expired entry (get() only drops the ones it runs into). Returns how many went."""
+        now = time.monotonic()
+        expired = [key for key, (_, expires) in self._data.items() if expires < now]
+        for key in expired: del self._data[key]
+        self.expirations += len(expired)
+        return len(expired)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return (self.hits / lookups) * 100 if lookups else 0.0
+
 # ============================= DATABASE SETUP ============================== #
+def _ensure_column(cursor, table, column, definition):
+    """Adds a column to a table created by an older version of the bot."""
+    if column not in [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
 def init_db():
     """Initializes the SQLite database and tables."""
     with sqlite3.connect(DB_FILE) as conn:
         cursor = conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
                 user_id INTEGER PRIMARY KEY,
@@ -59,6 +401,7 @@ def init_db():
                 join_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
+        _ensure_column(cursor, "users", "is_blocked", "BOOLEAN NOT NULL DEFAULT 0")
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS bot_status (
                 key TEXT PRIMARY KEY,
@@ -66,53 +409,270 @@ def init_db():
             )
         ''')
         cursor.execute("INSERT OR IGNORE INTO bot_status (key, value) VALUES ('is_active', '1')")
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                link TEXT NOT NULL,
+                title TEXT,
+                duration INTEGER,
+                thumb_url TEXT,
+                original_message_id INTEGER,
+                status_message_id INTEGER,
+                media_key TEXT,
+                priority INTEGER NOT NULL DEFAULT 0,
+                format TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                bytes_done INTEGER NOT NULL DEFAULT 0,
+                partial_path TEXT,
+                estimated_bytes INTEGER,
+                trace_id TEXT,
+                worker_id TEXT,
+                lease_until REAL,
+                not_before REAL NOT NULL DEFAULT 0,
+                cancel_requested BOOLEAN NOT NULL DEFAULT 0,
+                batch_id INTEGER,
+                state TEXT NOT NULL DEFAULT 'queued',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        _ensure_column(cursor, "jobs", "batch_id", "INTEGER")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (worker_id, priority, id)")
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS media_cache (
+                media_key TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                file_size INTEGER,
+                hits INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_media_cache_last_used ON media_cache (last_used)")
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS pending_confirmations (
+                data_key TEXT PRIMARY KEY,
+                link TEXT NOT NULL,
+                title TEXT,
+                duration INTEGER,
+                thumb_url TEXT,
+                original_message_id INTEGER,
+                media_key TEXT,
+                format TEXT,
+                estimated_bytes INTEGER,
+                trace_id TEXT,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_pending_confirmations_expires ON pending_confirmations (expires_at)")
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                admin_id INTEGER NOT NULL,
+                from_chat_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                status_message_id INTEGER,
+                state TEXT NOT NULL DEFAULT 'running',
+                cursor INTEGER NOT NULL DEFAULT 0,
+                total INTEGER NOT NULL DEFAULT 0,
+                sent INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                blocked INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS batches (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                link TEXT NOT NULL,
+                title TEXT,
+                status_message_id INTEGER,
+                state TEXT NOT NULL DEFAULT 'pending',
+                cursor INTEGER NOT NULL DEFAULT 0,
+                total INTEGER NOT NULL DEFAULT 0,
+                estimated_bytes INTEGER,
+                sent INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                trace_id TEXT,
+                created_at REAL NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
         conn.commit()
 
-def get_user_status(user_id: int):
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT is_verified, is_banned FROM users WHERE user_id = ?", (user_id,))
-        result = cursor.fetchone()
-        return {"verified": bool(result[0]), "banned": bool(result[1])} if result else None
+class Database:
+    """
+    Long-lived WAL-mode SQLite store that keeps all disk I/O off the event loop.
+    Reads run on a small pool of per-thread connections; writes are queued to a single
+    writer thread which commits each burst of queued statements in one transaction.
+    """
+    def __init__(self, path, readers=DB_READER_THREADS, batch_size=DB_WRITE_BATCH):
+        self.path, self.readers, self.batch_size = path, readers, batch_size
+        self._local = threading.local()
+        self._reader_pool = None
+        self._write_queue = None
+        self._writer = None
+        self._ready = threading.Event()
 
-def add_user(user_id: int):
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.cursor().execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
-        conn.commit()
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
 
-def update_user_verification(user_id: int, status: bool):
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.cursor().execute("UPDATE users SET is_verified = ? WHERE user_id = ?", (int(status), user_id))
-        conn.commit()
+    def open(self, init=None):
+        """Starts the DB threads without blocking. `init` (schema setup) runs first on the writer thread; reads wait for it."""
+        if self._writer: return
+        self._ready.clear()
+        self._reader_pool = ThreadPoolExecutor(max_workers=self.readers, thread_name_prefix="db-reader")
+        self._write_queue = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._writer_loop, args=(init,), name="db-writer", daemon=True)
+        self._writer.start()
 
-def set_user_ban_status(user_id: int, status: bool):
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.cursor().execute("UPDATE users SET is_banned = ? WHERE user_id = ?", (int(status), user_id))
-        conn.commit()
+    def close(self):
+        if not self._writer: return
+        self._write_queue.put(None)
+        self._writer.join()
+        self._reader_pool.shutdown(wait=True)
+        self._writer = self._reader_pool = None
 
-def get_all_user_ids():
-    with sqlite3.connect(DB_FILE) as conn:
-        return [row[0] for row in conn.cursor().execute("SELECT user_id FROM users WHERE is_banned = 0").fetchall()]
+    # --- Reads --- #
+    def _reader_conn(self):
+        self._ready.wait()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
 
-def get_total_users():
-    with sqlite3.connect(DB_FILE) as conn:
-        return conn.cursor().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    async def read(self, fn):
+        """Runs fn(conn) on a reader thread and returns its result."""
+        loop = asyncio.get_running_loop()
+        with metrics.timer("bot_db_seconds", op="read"):
+            return await loop.run_in_executor(self._reader_pool, lambda: fn(self._reader_conn()))
 
-def get_bot_status():
-    with sqlite3.connect(DB_FILE) as conn:
-        return conn.cursor().execute("SELECT value FROM bot_status WHERE key = 'is_active'").fetchone()[0] == '1'
+    async def fetchone(self, sql, params=()):
+        return await self.read(lambda conn: conn.execute(sql, params).fetchone())
 
-def set_bot_status(is_active: bool):
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.cursor().execute("UPDATE bot_status SET value = ? WHERE key = 'is_active'", (str(int(is_active)),))
-        conn.commit()
+    async def fetchall(self, sql, params=()):
+        return await self.read(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def fetchval(self, sql, params=(), default=None):
+        row = await self.fetchone(sql, params)
+        return row[0] if row else default
+
+    # --- Writes --- #
+    async def write(self, fn):
+        """Queues fn(conn) for the writer thread; it runs inside the current batch transaction."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._write_queue.put((fn, loop, future))
+        with metrics.timer("bot_db_seconds", op="write"):
+            return await future
+
+    async def execute(self, sql, params=()):
+        return await self.write(lambda conn: conn.execute(sql, params).rowcount)
+
+    async def executemany(self, sql, seq_of_params):
+        return await self.write(lambda conn: conn.executemany(sql, seq_of_params).rowcount)
+
+    @staticmethod
+    def _resolve(future, result=None, error=None):
+        if future.cancelled(): return
+        if error is not None: future.set_exception(error)
+        else: future.set_result(result)
+
+    def _writer_loop(self, init):
+        if init:
+            try: init()
+            except Exception as e: LOGGER.error(f"Database setup failed: {e}", exc_info=True)
+        self._ready.set()
+        conn = self._connect()
+        running = True
+        while running:
+            batch = [self._write_queue.get()]
+            while len(batch) < self.batch_size:
+                try: batch.append(self._write_queue.get_nowait())
+                except queue.Empty: break
+            if None in batch:
+                running = False
+                batch = [item for item in batch if item is not None]
+            if not batch: continue
+
+            outcomes = []
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for fn, loop, future in batch:
+                    # Each statement gets its own savepoint so one bad write doesn't sink the whole burst.
+                    conn.execute("SAVEPOINT w")
+                    try:
+                        outcomes.append((loop, future, fn(conn), None))
+                        conn.execute("RELEASE w")
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO w"); conn.execute("RELEASE w")
+                        outcomes.append((loop, future, None, e))
+                conn.execute("COMMIT")
+            except Exception as e:
+                LOGGER.error(f"Database write batch failed: {e}", exc_info=True)
+                if conn.in_transaction: conn.execute("ROLLBACK")
+                outcomes = [(loop, future, None, e) for _, loop, future in batch]
+
+            for loop, future, result, error in outcomes:
+                if not loop.is_closed(): loop.call_soon_threadsafe(self._resolve, future, result, error)
+        conn.close()
+
+db = Database(DB_FILE)
+user_status_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+async def get_user_status(user_id: int):
+    status = user_status_cache.get(user_id)
+    if status is not _MISSING: return status
+    epoch = user_status_cache.epoch
+    result = await db.fetchone("SELECT is_verified, is_banned FROM users WHERE user_id = ?", (user_id,))
+    status = {"verified": bool(result[0]), "banned": bool(result[1])} if result else None
+    user_status_cache.set(user_id, status, epoch)
+    return status
+
+async def add_user(user_id: int):
+    def _add(conn):
+        inserted = conn.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,)).rowcount
+        # A user talking to the bot again is reachable for broadcasts again.
+        conn.execute("UPDATE users SET is_blocked = 0 WHERE user_id = ? AND is_blocked = 1", (user_id,))
+        return inserted
+    if await db.write(_add):
+        user_status_cache.invalidate(user_id)
+
+async def update_user_verification(user_id: int, status: bool):
+    user_status_cache.invalidate(user_id)
+    await db.execute("UPDATE users SET is_verified = ? WHERE user_id = ?", (int(status), user_id))
+    user_status_cache.invalidate(user_id)
+
+async def set_user_ban_status(user_id: int, status: bool):
+    user_status_cache.invalidate(user_id)
+    await db.execute("UPDATE users SET is_banned = ? WHERE user_id = ?", (int(status), user_id))
+    user_status_cache.invalidate(user_id)
+
+async def get_total_users():
+    return await db.fetchval("SELECT COUNT(*) FROM users", default=0)
+
+async def get_bot_status():
+    return await db.fetchval("SELECT value FROM bot_status WHERE key = 'is_active'") == '1'
+
+async def set_bot_status(is_active: bool):
+    await db.execute("UPDATE bot_status SET value = ? WHERE key = 'is_active'", (str(int(is_active)),))
 
 
 # =============================== APP SETUP ================================= #
-app = Client("professional_downloader_session_v6", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
+# Workers log in with their own session (Pyrogram sessions can't be shared between processes) and take no updates.
+app = Client(
+    f"downloader_worker_{WORKER_ID}" if BOT_MODE == "worker" else "professional_downloader_session_v6",
+    api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN, no_updates=BOT_MODE == "worker"
+)
 
 # ============== GLOBAL STATE & HELPERS ===================================== #
-link_cache = {}
 active_downloads = set()
 cancelled_downloads = set()
 admin_states = {}
@@ -138,6 +698,209 @@ def get_progress_bar(percentage: float) -> str:
     filled_length = int(bar_length * percentage / 100)
     return f"{filled * filled_length}{empty * (bar_length - filled_length)}"
 
+def shorten(text: str, limit: int) -> str:
+    return (text[:limit] + '...') if len(text) > limit else text
+
+# ============== RATE LIMITING ============================================= #
+class TokenBucket:
+    """Async token bucket refilling `rate` tokens per second up to `capacity`. pause() stalls every caller (FloodWait)."""
+    def __init__(self, rate, capacity):
+        self.rate, self.capacity = rate, capacity
+        self._tokens, self._updated = float(capacity), time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        if time.monotonic() < self._paused_until: return False
+        self._refill()
+        if self._tokens < tokens: return False
+        self._tokens -= tokens
+        return True
+
+    async def acquire(self, tokens=1):
+        async with self._lock:
+            while True:
+                wait = self._paused_until - time.monotonic()
+                if wait <= 0:
+                    self._refill()
+                    if self._tokens >= tokens:
+                        self._tokens -= tokens
+                        return
+                    wait = (tokens - self._tokens) / self.rate
+                await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+class AdmissionControl:
+    """
+    Per-user admission for link previews, checked in memory before any extraction starts.
+    Each user gets a token bucket sized by their tier in USER_RATE_LIMITS plus a cap on
+    previews extracting at once; admins are exempt. admit() takes an extraction slot that
+    the handler must hand back with release(). Idle buckets expire (a full bucket is no
+    different from a new one), so memory stays bounded by recently active users.
+    """
+    def __init__(self, limits=USER_RATE_LIMITS, max_users=USER_CACHE_SIZE):
+        self.limits = limits
+        self._buckets = TTLCache(max_users, max(60 * tier["burst"] / tier["per_minute"] for tier in limits.values()))
+        self._notified = TTLCache(max_users, SLOW_DOWN_NOTICE_INTERVAL)
+        self._extracting = {}
+
+    @staticmethod
+    def tier_of(user_id):
+        return "trusted" if user_id in TRUSTED_USERS else "default"
+
+    def admit(self, user_id):
+        """Returns None and takes an extraction slot if the user may start a preview now, else the rejection reason."""
+        if user_id in ADMINS: return None
+        limits = self.limits[self.tier_of(user_id)]
+        if self._extracting.get(user_id, 0) >= limits["extractions"]: return "extractions"
+        bucket = self._buckets.get(user_id, None) or TokenBucket(limits["per_minute"] / 60, limits["burst"])
+        self._buckets.set(user_id, bucket)  # Re-set on every use, so only idle buckets expire.
+        if not bucket.try_acquire(): return "rate"
+        self._extracting[user_id] = self._extracting.get(user_id, 0) + 1
+        return None
+
+    def release(self, user_id):
+        if user_id in ADMINS: return
+        remaining = self._extracting.get(user_id, 0) - 1
+        if remaining > 0: self._extracting[user_id] = remaining
+        else: self._extracting.pop(user_id, None)
+
+    def should_notify(self, user_id):
+        """True at most once per SLOW_DOWN_NOTICE_INTERVAL per user, so a burst of rejected links gets a single reply."""
+        if self._notified.get(user_id, None): return False
+        self._notified.set(user_id, True)
+        return True
+
+admission = AdmissionControl()
+
+# ============== STATUS UPDATES ============================================ #
+def render_progress(stage, current, total, elapsed, short_title):
+    percentage = (current / total) * 100 if total > 0 else 0
+    speed = current / elapsed if elapsed > 0 else 0
+    eta = (total - current) / speed if speed > 0 else 0
+    header = "📥 **Downloading...**" if stage == 'download' else "☁️ **Uploading...**"
+    details = (
+        f"**Progress:** `{get_progress_bar(min(percentage, 100))} {percentage:.1f}%`\n"
+        f"**Status:** `{humanbytes(current)}` of `{humanbytes(total)}`\n"
+        f"**Speed:** `{humanbytes(speed)}/s`\n"
+        f"**ETA:** `{time_formatter(int(eta))}`"
+    )
+    return f"{header}\n\n**🏷️** `{short_title}`\n\n{details}"
+
+class ProgressSlot:
+    """Latest progress for one job. Hooks only replace `latest` (a single atomic store), from any thread."""
+    __slots__ = ("message", "short_title", "download_id", "latest", "consumed", "stage_started", "next_edit", "last_text", "edit_task")
+
+    def __init__(self, message, short_title, download_id):
+        self.message, self.short_title, self.download_id = message, short_title, download_id
+        self.latest = self.consumed = None
+        self.stage_started = time.monotonic()
+        self.next_edit = 0.0
+        self.last_text = None
+        self.edit_task = None  # Progress edit in flight, if any
+
+class StatusUpdateScheduler:
+    """
+    Single loop that turns progress slots into message edits. Each tick it edits the stalest
+    slots that changed, at most once per STATUS_EDIT_INTERVAL per message and within a global
+    STATUS_EDIT_RATE budget shared with every other status edit; a FloodWait pauses that budget.
+    """
+    def __init__(self, rate=STATUS_EDIT_RATE, interval=STATUS_EDIT_INTERVAL):
+        self.interval = interval
+        self.bucket = TokenBucket(rate, rate)
+        self._slots = {}
+        self._task = None
+        self.edits = self.skipped = self.flood_waits = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop())
+
+    def track(self, download_id, message, short_title):
+        self._slots[download_id] = ProgressSlot(message, short_title, download_id)
+
+    async def untrack(self, download_id):
+        """Stops progress edits for a job, waiting for one in flight so it can't land after a final edit."""
+        slot = self._slots.pop(download_id, None)
+        if slot and slot.edit_task: await slot.edit_task
+
+    async def begin_stage(self, download_id):
+        """Drops pending progress and waits out an edit in flight (so neither can overwrite a direct edit); restarts speed/ETA timing."""
+        slot = self._slots.get(download_id)
+        if slot:
+            slot.latest, slot.stage_started = None, time.monotonic()
+            if slot.edit_task: await slot.edit_task
+
+    def report(self, download_id, stage, current, total):
+        slot = self._slots.get(download_id)
+        if slot: slot.latest = (stage, current, total)
+
+    async def edit(self, message, text, reply_markup=None):
+        """Rate-budgeted edit for any status message. Returns False if it was not applied."""
+        await self.bucket.acquire()
+        try:
+            await message.edit_text(text, reply_markup=reply_markup)
+            self.edits += 1
+            return True
+        except MessageNotModified:
+            return True
+        except FloodWait as e:
+            self.flood_waits += 1
+            self.bucket.pause(e.value)
+            LOGGER.warning(f"FloodWait on status edit, pausing status updates for {e.value}s.")
+        except Exception as e:
+            LOGGER.warning(f"Status update failed: {e}")
+        return False
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(STATUS_TICK)
+            now = time.monotonic()
+            due = [
+                slot for slot in self._slots.values()
+                if slot.latest is not None and slot.latest is not slot.consumed and not slot.edit_task and now >= slot.next_edit
+            ]
+            due.sort(key=lambda slot: slot.next_edit)
+            for slot in due:
+                latest = slot.latest
+                text = render_progress(*latest, now - slot.stage_started, slot.short_title)
+                if text == slot.last_text:
+                    slot.consumed = latest
+                    self.skipped += 1
+                    continue
+                if not self.bucket.try_acquire(): break
+                slot.consumed = latest
+                slot.edit_task = asyncio.create_task(self._edit_slot(slot, text))
+
+    async def _edit_slot(self, slot, text):
+        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("✖️ Cancel", callback_data=f"cancel_dl_{slot.download_id}")]])
+        try:
+            await slot.message.edit_text(text, reply_markup=keyboard)
+            slot.last_text = text
+            self.edits += 1
+            slot.next_edit = time.monotonic() + self.interval
+        except MessageNotModified:
+            slot.last_text = text
+            slot.next_edit = time.monotonic() + self.interval
+        except FloodWait as e:
+            self.flood_waits += 1
+            self.bucket.pause(e.value)
+            slot.next_edit = time.monotonic() + e.value
+            LOGGER.warning(f"FloodWait on progress edit, pausing status updates for {e.value}s.")
+        except Exception as e:
+            slot.next_edit = time.monotonic() + self.interval
+            LOGGER.warning(f"Status update failed: {e}")
+        finally:
+            slot.edit_task = None
+
+status_updates = StatusUpdateScheduler()
+
 # ============== AGE VERIFICATION & START =================================== #
 @app.on_message(filters.command("start") & filters.private)
 async def start_command(client, message):
@@ -146,8 +909,8 @@ async def start_command(client, message):
         return
 
     user_id = message.from_user.id
-    add_user(user_id)
-    status = get_user_status(user_id)
+    await add_user(user_id)
+    status = await get_user_status(user_id)
 
     if status and status["banned"]:
         await message.reply_text("🚫 You are banned from using this bot.")
@@ -171,10 +934,10 @@ async def age_verification_callback(client, callback_query):
     action = callback_query.data.split("_")[-1]
 
     if action == "yes":
-        update_user_verification(user_id, True)
+        await update_user_verification(user_id, True)
         await callback_query.message.edit_text(f"✅ **Verification Successful!**\n\nWelcome, {callback_query.from_user.mention}.\nYou can now send a link to start downloading.")
     else:
-        set_user_ban_status(user_id, True)
+        await set_user_ban_status(user_id, True)
         await callback_query.message.edit_text("❌ **Access Denied**\n\nYou must be 18 or older to use this service. Your access has been restricted.")
         await callback_query.answer("Access Denied.", show_alert=True)
 
@@ -187,7 +950,7 @@ async def is_verified(_, __, message: Message):
         await message.reply_text("🤖 The bot is currently offline for maintenance. Please try again later.", quote=True)
         return False
 
-    status = get_user_status(user_id)
+    status = await get_user_status(user_id)
     if status and status["verified"] and not status["banned"]: return True
     
     if isinstance(message, Message): await start_command(__, message)
@@ -195,41 +958,1339 @@ async def is_verified(_, __, message: Message):
 
 verified_user_filter = filters.create(is_verified)
 
+async def is_admitted(_, __, message: Message):
+    """Per-user rate limit for link previews. A passing message holds an extraction slot its handler must release."""
+    user_id = message.from_user.id
+    reason = admission.admit(user_id)
+    if reason is None: return True
+    metrics.inc("bot_admission_rejections_total", reason=reason)
+    if admission.should_notify(user_id):
+        if reason == "extractions": text = "🐢 **Slow down!** Please wait until your previous link has been processed before sending another."
+        else: text = "🐢 **Slow down!** You're sending links too fast. Please wait a moment before sending more."
+        await message.reply_text(f"{text}\n\n_Links sent in the meantime are ignored._", quote=True)
+    return False
+
+# Must come last in a handler's filter chain: the slot it takes is only released by the handler.
+admission_filter = filters.create(is_admitted)
+
+# ============== TELEGRAM FILE_ID CACHE ==================================== #
+def media_key_for(info_dict, link, format_selector=VIDEO_FORMAT):
+    """Normalized cache key: extractor + video id (falls back to the raw link) + format selector."""
+    extractor, video_id = info_dict.get('extractor_key') or info_dict.get('extractor'), info_dict.get('id')
+    source = f"{extractor}:{video_id}" if extractor and video_id else link
+    return f"{source}|{format_selector}"
+
+class MediaCache:
+    """
+    Maps media keys to the file_id Telegram returned for an upload, so repeat requests are
+    answered by re-sending the file_id. file_ids outlive the messages they came from, so
+    self-destructed videos stay reusable. Entries are evicted LRU beyond `max_entries` and
+    after `max_age` seconds.
+    """
+    def __init__(self, max_entries=MEDIA_CACHE_MAX_ENTRIES, max_age=MEDIA_CACHE_MAX_AGE):
+        self.max_entries, self.max_age = max_entries, max_age
+        self.hits = self.misses = self.stale = 0
+
+    async def lookup(self, media_key, recheck=False):
+        """Returns the cached file_id or None; `recheck` lookups don't count towards hit/miss stats."""
+        if not media_key: return None
+        file_id = await db.fetchval(
+            "SELECT file_id FROM media_cache WHERE media_key = ? AND created_at > ?",
+            (media_key, time.time() - self.max_age)
+        )
+        if file_id:
+            await db.execute("UPDATE media_cache SET hits = hits + 1, last_used = ? WHERE media_key = ?", (time.time(), media_key))
+        if not recheck:
+            if file_id: self.hits += 1
+            else: self.misses += 1
+        return file_id
+
+    async def store(self, media_key, video):
+        if not media_key or not video: return
+        now = time.time()
+        await db.execute(
+            "INSERT OR REPLACE INTO media_cache (media_key, file_id, file_size, hits, created_at, last_used) VALUES (?, ?, ?, 0, ?, ?)",
+            (media_key, video.file_id, video.file_size, now, now)
+        )
+        await self.evict()
+
+    async def forget(self, media_key):
+        self.stale += 1
+        await db.execute("DELETE FROM media_cache WHERE media_key = ?", (media_key,))
+
+    async def evict(self):
+        def _evict(conn):
+            conn.execute("DELETE FROM media_cache WHERE created_at <= ?", (time.time() - self.max_age,))
+            conn.execute(
+                "DELETE FROM media_cache WHERE media_key IN "
+                "(SELECT media_key FROM media_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+        await db.write(_evict)
+
+    async def size(self):
+        return await db.fetchone("SELECT COUNT(*), COALESCE(SUM(file_size), 0) FROM media_cache")
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return (self.hits / lookups) * 100 if lookups else 0.0
+
+media_cache = MediaCache()
+
+async def send_cached_video(user_id, media_key, title, duration, recheck=False):
+    """Re-sends a previously uploaded video by file_id. Returns the sent message, or None on a miss."""
+    file_id = await media_cache.lookup(media_key, recheck)
+    if not file_id: return None
+    try:
+        sent_video = await app.send_video(user_id, video=file_id, caption=video_caption(title), duration=duration, has_spoiler=True)
+    except FloodWait:
+        raise
+    except Exception as e:
+        LOGGER.warning(f"Cached file_id for {media_key} was rejected, falling back to download: {e}")
+        await media_cache.forget(media_key)
+        return None
+    LOGGER.info(f"Served {media_key} to user {user_id} from the file_id cache.")
+    if SELF_DESTRUCT_TIMER > 0:
+        asyncio.create_task(self_destruct(sent_video, user_id))
+    return sent_video
+
+# ============== JOB SCHEDULER ============================================= #
+# Everything a confirmed preview needs to become a job.
+LinkData = namedtuple("LinkData", [
+    "link", "title", "duration", "thumb_url", "original_message_id", "media_key", "format", "estimated_bytes", "trace_id"
+])
+
+@dataclass(eq=False)
+class Job:
+    id: int
+    user_id: int
+    link: str
+    title: str
+    duration: int
+    thumb_url: str
+    original_message_id: int
+    status_message_id: int
+    media_key: str = None
+    priority: int = 0
+    format: str = VIDEO_FORMAT
+    attempts: int = 0
+    bytes_done: int = 0
+    partial_path: str = None
+    estimated_bytes: int = None
+    trace_id: str = None
+    batch_id: int = None
+    message: Message = None
+    position: int = 0
+    enqueued_at: float = 0.0
+    holds_download_slot: bool = False
+    retry_handle: asyncio.TimerHandle = None
+    outcome: str = None
+    finished: asyncio.Future = None
+
+    @property
+    def download_id(self):
+        return str(self.id)
+
+    @property
+    def link_data(self):
+        return LinkData(self.link, self.title, self.duration, self.thumb_url, self.original_message_id, self.media_key, self.format, self.estimated_bytes, self.trace_id)
+
+class JobScheduler:
+    """
+    Persistent download queue. Jobs live in the `jobs` table until they finish, so a restart
+    picks them up again. Queued jobs are served round-robin across users (admins in their own
+    lane, served first) subject to a per-user cap; the download and upload stages draw from
+    separate slot pools so one job can upload while the next one downloads. Entries of a
+    playlist batch get up to BATCH_LOOKAHEAD jobs per user, but only one of them downloads at a
+    time. Jobs that hit a transient error keep their partial files and are re-queued with
+    exponential backoff.
+    """
+    def __init__(self, download_slots=MAX_CONCURRENT_DOWNLOADS, upload_slots=MAX_CONCURRENT_UPLOADS, per_user=MAX_ACTIVE_JOBS_PER_USER):
+        self.download_slots, self.per_user = download_slots, per_user
+        self.upload_slots = asyncio.Semaphore(upload_slots)
+        self._lanes = (OrderedDict(), OrderedDict())  # (admin lane, user lane): user_id -> deque[Job]
+        self._jobs = {}
+        self._running_per_user = defaultdict(int)
+        self._downloading = 0
+        self._downloading_batches = defaultdict(int)
+        self._wakeup = asyncio.Event()
+        self._refresh_pending = self._refresh_dirty = False
+        self._running = set()
+        self._task = self._checkpoint_task = None
+
+    def __len__(self):
+        return sum(len(q) for lane in self._lanes for q in lane.values())
+
+    @property
+    def active_count(self):
+        return len(self._running)
+
+    async def start(self):
+        await db.execute(f"DELETE FROM jobs WHERE {FINISHED_JOB_SQL}")  # Outcomes left over from split mode.
+        rows = await db.fetchall(f"SELECT {JOB_COLUMNS} FROM jobs ORDER BY id")
+        await db.execute("UPDATE jobs SET state = 'queued' WHERE state != 'queued'")
+        for row in rows:
+            if str(row[0]) in self._jobs: continue  # Submitted since the bot came online.
+            job = Job(*row)
+            try:
+                if await attach_status_message(job, "🔁 `Your download was restored after a restart.`"):
+                    self._enqueue(job)
+                    continue
+                LOGGER.warning(f"Dropping restored job {job.id}: user {job.user_id} can't be reached.")
+                await db.execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+                remove_job_files(job.download_id)
+            except Exception as e:
+                LOGGER.error(f"Could not restore job {job.id}: {e}", exc_info=True)
+        if rows: LOGGER.info(f"Restored {len(rows)} queued job(s) from the database.")
+        self._task = asyncio.create_task(self._dispatch_loop())
+        self._checkpoint_task = asyncio.create_task(self._checkpoint_loop())
+
+    async def submit(self, user_id, link_data, status_message, batch_id=None):
+        job = await insert_job(user_id, link_data, status_message, batch_id)
+        self._enqueue(job)
+        return job
+
+    async def batch_jobs(self, batch_id):
+        """Entries of a batch that are still queued, running or waiting for a retry."""
+        return [job for job in self._jobs.values() if job.batch_id == batch_id]
+
+    async def wait_finished(self, job):
+        """Waits until a job has left the queue for good; returns its outcome ('done', 'cached', 'failed' or 'cancelled')."""
+        if job.download_id in self._jobs:
+            job.finished = job.finished or asyncio.get_running_loop().create_future()
+            await job.finished
+        return job.outcome or 'failed'
+
+    def _settle(self, job):
+        self._jobs.pop(job.download_id, None)
+        if job.finished and not job.finished.done(): job.finished.set_result(job.outcome)
+
+    def _enqueue(self, job):
+        job.retry_handle = None
+        job.enqueued_at = time.monotonic()
+        self._jobs[job.download_id] = job
+        lane = self._lanes[0] if job.priority else self._lanes[1]
+        lane.setdefault(job.user_id, deque()).append(job)
+        self._wakeup.set()
+
+    async def request_cancel(self, download_id):
+        """Running jobs are cancelled in-process via active_downloads; there is nothing to flag."""
+        return False
+
+    async def cancel_queued(self, download_id):
+        """Removes a job that hasn't started yet. Returns it, or None if it isn't queued."""
+        job = self._jobs.get(download_id)
+        if not job: return None
+        if job.retry_handle:
+            job.retry_handle.cancel()
+            job.retry_handle = None
+            job.outcome = 'cancelled'
+            self._settle(job)
+            await db.execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+            remove_job_files(download_id)
+            return job
+        for lane in self._lanes:
+            user_queue = lane.get(job.user_id)
+            if user_queue and job in user_queue:
+                user_queue.remove(job)
+                if not user_queue: del lane[job.user_id]
+                job.outcome = 'cancelled'
+                self._settle(job)
+                await db.execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+                remove_job_files(download_id)
+                self._schedule_position_refresh()
+                return job
+        return None
+
+    def _push_front(self, job):
+        lane = self._lanes[0] if job.priority else self._lanes[1]
+        lane.setdefault(job.user_id, deque()).appendleft(job)
+        lane.move_to_end(job.user_id, last=False)
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _next_job(self):
+        for lane in self._lanes:
+            for user_id in list(lane):
+                user_queue = lane[user_id]
+                batch_id = user_queue[0].batch_id
+                if batch_id:
+                    # Batch entries pipeline: the next one may download while the previous one uploads.
+                    if self._downloading_batches.get(batch_id) or self._running_per_user[user_id] >= max(self.per_user, BATCH_LOOKAHEAD): continue
+                elif self._running_per_user[user_id] >= self.per_user: continue
+                job = user_queue.popleft()
+                if user_queue: lane.move_to_end(user_id)
+                else: del lane[user_id]
+                return job
+        return None
+
+    async def _dispatch_loop(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._downloading < self.download_slots:
+                job = self._next_job()
+                if not job: break
+                if not storage.try_reserve(job):
+                    # Not enough space yet: keep the job at the head of its queue until a release or sweep wakes us.
+                    self._push_front(job)
+                    break
+                metrics.observe("bot_stage_seconds", time.monotonic() - job.enqueued_at, stage="queue")
+                self._take_slots(job)
+                asyncio.create_task(self._run(job))
+            self._schedule_position_refresh()
+
+    def _take_slots(self, job):
+        self._downloading += 1
+        job.holds_download_slot = True
+        if job.batch_id: self._downloading_batches[job.batch_id] += 1
+        self._running_per_user[job.user_id] += 1
+
+    async def _run(self, job):
+        retry_after = None
+        trace_id_var.set(job.trace_id or new_trace_id())
+        self._running.add(job)
+        LOGGER.info(f"Starting job {job.id} for user {job.user_id} (attempt {job.attempts + 1}).")
+        try:
+            await set_job_state(job, 'downloading')
+            retry_after = await download_and_upload(job)
+        except Exception as e:
+            LOGGER.error(f"Job {job.id} crashed: {e}", exc_info=True)
+        finally:
+            self._running.discard(job)
+            storage.release(job.download_id)
+            self.release_download_slot(job)
+            self._running_per_user[job.user_id] -= 1
+            if not self._running_per_user[job.user_id]: del self._running_per_user[job.user_id]
+            await self._finish(job, retry_after)
+            self._wakeup.set()
+
+    async def _finish(self, job, retry_after):
+        """Drops a finished job, or keeps it for a retry after `retry_after` seconds."""
+        if retry_after is None:
+            self._settle(job)
+            await db.execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+        else:
+            await db.execute(
+                "UPDATE jobs SET state = 'retrying', attempts = ?, bytes_done = ?, partial_path = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (job.attempts, job.bytes_done, job.partial_path, job.id)
+            )
+            job.retry_handle = asyncio.get_running_loop().call_later(retry_after, self._enqueue, job)
+
+    async def _checkpoint_loop(self):
+        """Periodically records how far running downloads have got, so a restart can report and resume them."""
+        while True:
+            await asyncio.sleep(JOB_CHECKPOINT_INTERVAL)
+            progress = [(job.bytes_done, job.partial_path, job.id) for job in self._running if job.bytes_done]
+            if progress:
+                try: await db.executemany("UPDATE jobs SET bytes_done = ?, partial_path = ? WHERE id = ?", progress)
+                except Exception as e: LOGGER.warning(f"Job checkpoint failed: {e}")
+
+    def release_download_slot(self, job):
+        """Frees the job's download slot once its download stage is over (idempotent)."""
+        if job.holds_download_slot:
+            job.holds_download_slot = False
+            self._downloading -= 1
+            if job.batch_id:
+                self._downloading_batches[job.batch_id] -= 1
+                if not self._downloading_batches[job.batch_id]: del self._downloading_batches[job.batch_id]
+            self._wakeup.set()
+
+    def _queued_in_order(self):
+        """Queued jobs in the order the round-robin would serve them (ignoring per-user caps)."""
+        for lane in self._lanes:
+            queues = [list(q) for q in lane.values()]
+            for depth in range(max(map(len, queues), default=0)):
+                for user_queue in queues:
+                    if depth < len(user_queue): yield user_queue[depth]
+
+    def _schedule_position_refresh(self):
+        self._refresh_dirty = True
+        if self._refresh_pending: return
+        self._refresh_pending = True
+        asyncio.create_task(self._refresh_positions())
+
+    async def _refresh_positions(self):
+        """One refresh at a time; repeats until no queue change arrived while it was editing."""
+        try:
+            while self._refresh_dirty:
+                await asyncio.sleep(QUEUE_POSITION_REFRESH)
+                self._refresh_dirty = False
+                await show_queue_positions(list(self._queued_in_order()))
+        finally:
+            self._refresh_pending = False
+
+FINISHED_JOB_STATES = ('done', 'cached', 'failed', 'cancelled')
+FINISHED_JOB_SQL = f"state IN {FINISHED_JOB_STATES}"
+JOB_COLUMNS = (
+    "id, user_id, link, title, duration, thumb_url, original_message_id, status_message_id, media_key, priority, "
+    "format, attempts, bytes_done, partial_path, estimated_bytes, trace_id, batch_id"
+)
+
+async def insert_job(user_id, link_data, status_message, batch_id=None):
+    link, title, duration, thumb_url, original_message_id, media_key, format_selector, estimated_bytes, trace_id = link_data
+    priority = int(user_id in ADMINS)
+    job_id = await db.write(lambda conn: conn.execute(
+        "INSERT INTO jobs (user_id, link, title, duration, thumb_url, original_message_id, status_message_id, media_key, priority, format, estimated_bytes, trace_id, batch_id) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (user_id, link, title, duration, thumb_url, original_message_id, status_message.id, media_key, priority, format_selector, estimated_bytes, trace_id, batch_id)
+    ).lastrowid)
+    return Job(
+        job_id, user_id, link, title, duration, thumb_url, original_message_id, status_message.id, media_key, priority,
+        format=format_selector, estimated_bytes=estimated_bytes, trace_id=trace_id, batch_id=batch_id, message=status_message
+    )
+
+async def restore_status_message(chat_id, message_id, fallback_text):
+    """
+    Loads a stored status message, posting `fallback_text` instead if the old message is gone.
+    Returns None if the chat can't be reached at all (bot blocked, account deleted).
+    """
+    try:
+        message = await app.get_messages(chat_id, message_id)
+        if not message.empty: return message
+    except Exception:
+        pass
+    try:
+        return await app.send_message(chat_id, fallback_text)
+    except Exception as e:
+        LOGGER.warning(f"Could not restore a status message in chat {chat_id}: {e}")
+        return None
+
+async def attach_status_message(job, fallback_text):
+    """Loads a stored job's status message (see restore_status_message). Returns False if the user can't be reached."""
+    job.trace_id = job.trace_id or new_trace_id()
+    message = await restore_status_message(job.user_id, job.status_message_id, fallback_text)
+    if message is None: return False
+    job.message = message
+    if message.id != job.status_message_id:
+        job.status_message_id = message.id
+        await db.execute("UPDATE jobs SET status_message_id = ? WHERE id = ?", (job.status_message_id, job.id))
+    return True
+
+async def show_queue_positions(queued):
+    """
+    Edits the status messages of queued jobs whose position in `queued` changed (None entries
+    only hold a place). Past the first QUEUE_POSITION_EXACT, a message is only edited when its
+    position moves into another block of that size, keeping one dequeue from costing an edit
+    per queued job.
+    """
+    for position, job in enumerate(queued, start=1):
+        if not job or job.position == position or not job.message: continue
+        if job.position > QUEUE_POSITION_EXACT and (position - 1) // QUEUE_POSITION_EXACT == (job.position - 1) // QUEUE_POSITION_EXACT: continue
+        job.position = position
+        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("✖️ Cancel", callback_data=f"cancel_dl_{job.download_id}")]])
+        text = f"⏳ **Queued**\n\n**🏷️** `{shorten(job.title, 60)}`\n\n**Position:** `{position}` of `{len(queued)}`"
+        if not await status_updates.edit(job.message, text, keyboard): job.position = 0
+
+async def set_job_state(job, state):
+    await db.execute("UPDATE jobs SET state = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?", (state, job.id))
+
+class RemoteJobQueue:
+    """
+    Front-end side of split mode. Jobs are only written to the shared `jobs` table, where
+    worker processes claim them; nothing runs here. A poll loop keeps the queue counts for the
+    admin panel and the position messages of jobs submitted through this process up to date.
+    Cancelling a claimed job sets its `cancel_requested` flag for the owning worker.
+    """
+    def __init__(self):
+        self.queued = self.running = 0
+        self._waiting = {}  # job id -> Job, for position messages
+        self._task = None
+
+    def __len__(self):
+        return self.queued
+
+    @property
+    def active_count(self):
+        return self.running
+
+    def wake(self):
+        pass
+
+    async def start(self):
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def submit(self, user_id, link_data, status_message, batch_id=None):
+        job = await insert_job(user_id, link_data, status_message, batch_id)
+        self._waiting[job.id] = job
+        self.queued += 1
+        return job
+
+    async def batch_jobs(self, batch_id):
+        """Entries of a batch still in the `jobs` table, including finished ones whose outcome wasn't collected yet."""
+        return [Job(*row) for row in await db.fetchall(f"SELECT {JOB_COLUMNS} FROM jobs WHERE batch_id = ? ORDER BY id", (batch_id,))]
+
+    async def wait_finished(self, job):
+        """Polls until a worker has recorded the job's outcome in its row, then clears the row."""
+        while job.outcome is None:
+            state = await db.fetchval("SELECT state FROM jobs WHERE id = ?", (job.id,))
+            if state is None or state in FINISHED_JOB_STATES:
+                job.outcome = state or 'failed'
+                break
+            await asyncio.sleep(WORKER_POLL_INTERVAL)
+        await db.execute(f"DELETE FROM jobs WHERE id = ? AND {FINISHED_JOB_SQL}", (job.id,))
+        return job.outcome
+
+    async def cancel_queued(self, download_id):
+        """Deletes the job if no worker has claimed it yet (a queued or backing-off job)."""
+        if not await db.execute(f"DELETE FROM jobs WHERE id = ? AND worker_id IS NULL AND NOT {FINISHED_JOB_SQL}", (int(download_id),)): return None
+        self.queued = max(0, self.queued - 1)
+        remove_job_files(download_id)
+        job = self._waiting.pop(int(download_id), None)
+        if job: job.outcome = 'cancelled'
+        return job or True
+
+    async def request_cancel(self, download_id):
+        return bool(await db.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND worker_id IS NOT NULL", (int(download_id),)))
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(WORKER_POLL_INTERVAL)
+            try:
+                # Outcomes nobody waited for (e.g. jobs of a previous front-end run) are cleared after a while.
+                await db.execute(f"DELETE FROM jobs WHERE {FINISHED_JOB_SQL} AND updated_at < datetime('now', ?)", (f"-{JOB_OUTCOME_RETENTION} seconds",))
+                rows = await db.fetchall(f"SELECT id, worker_id IS NOT NULL FROM jobs WHERE NOT {FINISHED_JOB_SQL} ORDER BY priority DESC, id")
+                queued_ids = [job_id for job_id, claimed in rows if not claimed]
+                self.queued, self.running = len(queued_ids), len(rows) - len(queued_ids)
+                for job_id in set(self._waiting) - set(queued_ids): del self._waiting[job_id]
+                await show_queue_positions([self._waiting.get(job_id) for job_id in queued_ids])
+            except Exception as e:
+                LOGGER.warning(f"Queue refresh failed: {e}")
+
+class JobWorker(JobScheduler):
+    """
+    Worker side of split mode (`python bot.py --worker`). Claims jobs from the shared `jobs`
+    table under a lease of JOB_LEASE_DURATION seconds, renewed by a heartbeat that also saves
+    progress; a job whose worker died is re-queued once its lease lapses. Claiming respects
+    admin priority and the per-user cap across all workers. Jobs run through the same
+    download/upload path as standalone mode. A finished job's row is kept with its outcome as
+    `state` for the front end to collect.
+    """
+    def __init__(self, worker_id=WORKER_ID, **kwargs):
+        super().__init__(**kwargs)
+        self.worker_id = worker_id
+
+    def __len__(self):
+        return 0
+
+    async def start(self):
+        # Jobs this worker held before a restart go back to the queue straight away.
+        released = await db.execute("UPDATE jobs SET state = 'queued', worker_id = NULL, lease_until = NULL WHERE worker_id = ?", (self.worker_id,))
+        if released: LOGGER.info(f"Released {released} job(s) held by a previous run of worker {self.worker_id}.")
+        self._task = asyncio.create_task(self._dispatch_loop())
+        self._checkpoint_task = asyncio.create_task(self._checkpoint_loop())
+
+    async def cancel_queued(self, download_id):
+        return None
+
+    def _claim(self, conn):
+        now = time.time()
+        conn.execute("UPDATE jobs SET state = 'queued', worker_id = NULL, lease_until = NULL WHERE worker_id IS NOT NULL AND lease_until < ?", (now,))
+        row = conn.execute(
+            f"SELECT {JOB_COLUMNS} FROM jobs AS j WHERE worker_id IS NULL AND NOT {FINISHED_JOB_SQL} AND not_before <= ? "
+            "AND (SELECT COUNT(*) FROM jobs AS r WHERE r.user_id = j.user_id AND r.worker_id IS NOT NULL) < ? "
+            "ORDER BY priority DESC, id LIMIT 1",
+            (now, self.per_user)
+        ).fetchone()
+        if row:
+            conn.execute(
+                "UPDATE jobs SET state = 'downloading', worker_id = ?, lease_until = ?, cancel_requested = 0, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (self.worker_id, now + JOB_LEASE_DURATION, row[0])
+            )
+        return row
+
+    async def _unclaim(self, job, failed=False):
+        """
+        Hands a claimed job back to the queue. A failed start counts as an attempt and backs
+        off like a retry; past JOB_MAX_RETRIES the job is dropped.
+        """
+        not_before = 0
+        if failed:
+            job.attempts += 1
+            if job.attempts > JOB_MAX_RETRIES:
+                LOGGER.error(f"Dropping job {job.id}: it failed to start {job.attempts} times.")
+                await self._drop(job)
+                return
+            not_before = time.time() + JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1)
+        await db.execute(
+            "UPDATE jobs SET state = 'queued', worker_id = NULL, lease_until = NULL, attempts = ?, not_before = ? WHERE id = ? AND worker_id = ?",
+            (job.attempts, not_before, job.id, self.worker_id)
+        )
+
+    async def _drop(self, job):
+        record_outcome(job, 'failed')
+        await self._record(job)
+        remove_job_files(job.download_id)
+
+    async def _record(self, job):
+        """Releases a finished job, leaving its outcome in the row's `state` for the front end."""
+        await db.execute(
+            "UPDATE jobs SET state = ?, worker_id = NULL, lease_until = NULL, updated_at = CURRENT_TIMESTAMP WHERE id = ? AND worker_id = ?",
+            (job.outcome if job.outcome in FINISHED_JOB_STATES else 'failed', job.id, self.worker_id)
+        )
+
+    async def _dispatch_loop(self):
+        while True:
+            try:
+                while self._downloading < self.download_slots:
+                    row = await db.write(self._claim)
+                    if not row: break
+                    job = Job(*row)
+                    if not storage.try_reserve(job):
+                        await self._unclaim(job)
+                        break
+                    try:
+                        reachable = await attach_status_message(job, "⏳ `Your download is starting...`")
+                    except Exception as e:
+                        LOGGER.error(f"Could not start job {job.id}: {e}", exc_info=True)
+                        storage.release(job.download_id)
+                        await self._unclaim(job, failed=True)
+                        continue
+                    if not reachable:
+                        LOGGER.warning(f"Dropping job {job.id}: user {job.user_id} can't be reached.")
+                        storage.release(job.download_id)
+                        await self._drop(job)
+                        continue
+                    self._take_slots(job)
+                    asyncio.create_task(self._run(job))
+            except Exception as e:
+                LOGGER.error(f"Claiming jobs failed: {e}", exc_info=True)
+            try: await asyncio.wait_for(self._wakeup.wait(), WORKER_POLL_INTERVAL)
+            except asyncio.TimeoutError: pass
+            self._wakeup.clear()
+
+    async def _finish(self, job, retry_after):
+        if retry_after is None:
+            await self._record(job)
+        else:
+            await db.execute(
+                "UPDATE jobs SET state = 'retrying', worker_id = NULL, lease_until = NULL, not_before = ?, attempts = ?, bytes_done = ?, "
+                "partial_path = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ? AND worker_id = ?",
+                (time.time() + retry_after, job.attempts, job.bytes_done, job.partial_path, job.id, self.worker_id)
+            )
+
+    async def _checkpoint_loop(self):
+        """Heartbeat: renews leases with progress every JOB_HEARTBEAT_INTERVAL and acts on cancel requests."""
+        last_heartbeat = 0
+        while True:
+            await asyncio.sleep(WORKER_POLL_INTERVAL)
+            try:
+                if time.monotonic() - last_heartbeat >= JOB_HEARTBEAT_INTERVAL:
+                    last_heartbeat = time.monotonic()
+                    for job in list(self._running):
+                        renewed = await db.execute(
+                            "UPDATE jobs SET lease_until = ?, bytes_done = ?, partial_path = ? WHERE id = ? AND worker_id = ?",
+                            (time.time() + JOB_LEASE_DURATION, job.bytes_done, job.partial_path, job.id, self.worker_id)
+                        )
+                        if not renewed and job.download_id in active_downloads:
+                            LOGGER.warning(f"Lost the lease on job {job.id}; stopping it.")
+                            await cancel_active_download(job.download_id)
+                rows = await db.fetchall("SELECT id FROM jobs WHERE worker_id = ? AND cancel_requested = 1", (self.worker_id,))
+                for (job_id,) in rows:
+                    if str(job_id) in active_downloads and str(job_id) not in cancelled_downloads:
+                        await cancel_active_download(str(job_id))
+            except Exception as e:
+                LOGGER.warning(f"Worker heartbeat failed: {e}")
+
+scheduler = {"frontend": RemoteJobQueue, "worker": JobWorker}.get(BOT_MODE, JobScheduler)()
+metrics.gauge("bot_queued_jobs", "Jobs waiting in the download queue.", lambda: len(scheduler))
+metrics.gauge("bot_active_downloads", "Jobs currently downloading or uploading.", lambda: len(active_downloads))
+
+# ============== HTTP CLIENT & THUMBNAILS ================================== #
+_http_session = None
+
+async def get_http_session():
+    """Application-wide aiohttp session: pooled keep-alive connections, cached DNS and bounded timeouts."""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, ttl_dns_cache=HTTP_DNS_CACHE_TTL, keepalive_timeout=HTTP_KEEPALIVE)
+        timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT, sock_connect=HTTP_CONNECT_TIMEOUT)
+        _http_session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return _http_session
+
+async def close_http_session():
+    if _http_session and not _http_session.closed: await _http_session.close()
+
+FFMPEG = shutil.which("ffmpeg")
+TELEGRAM_THUMB_MAX_BYTES = 200 * 1024  # Telegram ignores thumbnails above 200 KB or 320px.
+
+class ThumbnailCache:
+    """
+    Disk cache of Telegram-ready thumbnails (JPEG, at most THUMB_SIZE px) keyed by source URL.
+    Sources are streamed to disk through the shared HTTP session and downscaled with ffmpeg;
+    the least recently used files are evicted once the cache passes `max_bytes`. Concurrent
+    requests for the same URL share one fetch.
+    """
+    def __init__(self, path=THUMB_CACHE_PATH, max_bytes=THUMB_CACHE_MAX_BYTES):
+        self.path, self.max_bytes = path, max_bytes
+        self._inflight = {}
+        self.hits = self.misses = 0
+
+    def _path_for(self, url):
+        return os.path.join(self.path, hashlib.sha1(url.encode()).hexdigest() + ".jpg")
+
+    async def get(self, url):
+        """Returns a local thumbnail path for `url`, or None if it couldn't be fetched."""
+        if not url: return None
+        path = self._path_for(url)
+        if os.path.exists(path):
+            self.hits += 1
+            os.utime(path)
+            return path
+
+        task = self._inflight.get(url)
+        if task is None:
+            self.misses += 1
+            task = self._inflight[url] = asyncio.ensure_future(self._fetch(url, path))
+            task.add_done_callback(lambda _: self._inflight.pop(url, None))
+        try:
+            return await asyncio.shield(task)
+        except Exception as e:
+            LOGGER.warning(f"Thumbnail fetch failed for {url}: {e}")
+            return None
+
+    async def _fetch(self, url, path):
+        os.makedirs(self.path, exist_ok=True)
+        source = f"{path}.src"
+        start = time.perf_counter()
+        try:
+            session = await get_http_session()
+            async with session.get(url) as resp:
+                resp.raise_for_status()
+                with open(source, "wb") as f:
+                    async for chunk in resp.content.iter_chunked(64 * 1024): f.write(chunk)
+            await self._downscale(source, path)
+        except Exception as e:
+            metrics.inc("bot_errors_total", stage="thumbnail", type=error_type(e), extractor=extractor_of(None, url))
+            raise
+        finally:
+            if os.path.exists(source): os.remove(source)
+        metrics.observe("bot_stage_seconds", time.perf_counter() - start, stage="thumbnail")
+        await asyncio.to_thread(self._evict)
+        return path
+
+    @staticmethod
+    async def _downscale(source, path):
+        if FFMPEG:
+            scaled = f"{path}.tmp.jpg"
+            process = await asyncio.create_subprocess_exec(
+                FFMPEG, "-y", "-loglevel", "error", "-i", source, "-frames:v", "1", "-q:v", "5",
+                "-vf", f"scale='min({THUMB_SIZE},iw)':'min({THUMB_SIZE},ih)':force_original_aspect_ratio=decrease",
+                scaled, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+            )
+            if await process.wait() == 0 and os.path.getsize(scaled) <= TELEGRAM_THUMB_MAX_BYTES:
+                os.replace(scaled, path)
+                return
+            if os.path.exists(scaled): os.remove(scaled)
+        # Without ffmpeg the source is only usable if it already fits Telegram's limits.
+        with open(source, "rb") as f: is_jpeg = f.read(3) == b"\xff\xd8\xff"
+        if not is_jpeg or os.path.getsize(source) > TELEGRAM_THUMB_MAX_BYTES:
+            raise ValueError("could not produce a Telegram-sized thumbnail")
+        os.replace(source, path)
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".jpg") and not entry.name.endswith(".tmp.jpg"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes: break
+            try: os.remove(path)
+            except OSError: continue
+            total -= size
+
+thumbnails = ThumbnailCache()
+
+# ============== METADATA EXTRACTION ======================================= #
+metadata_cache = TTLCache(METADATA_CACHE_SIZE, METADATA_CACHE_TTL)
+_inflight_extractions = {}
+
+def _extract_blocking(link):
+    ydl_opts = {'noplaylist': True, 'quiet': True, 'no_warnings': True, 'forcejson': True}
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        return ydl.extract_info(link, download=False)
+
+def _preload_ytdlp():
+    """Imports yt-dlp, builds its extractor table and loads the most used extractors, so the first link doesn't pay for it."""
+    with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}) as ydl:
+        for ie_key in PRELOAD_EXTRACTORS: ydl.get_info_extractor(ie_key)
+
+def _extract_page_blocking(link, start, end):
+    """
+    Flat-extracts entries `start`..`end` (1-based) of a playlist without resolving them, so only
+    the listing pages covering that range are fetched. Returns None if the link isn't a playlist.
+    """
+    ydl_opts = {'quiet': True, 'no_warnings': True, 'extract_flat': 'in_playlist', 'playliststart': start, 'playlistend': end}
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info_dict = ydl.extract_info(link, download=False)
+    if info_dict.get('_type') not in ('playlist', 'multi_video'): return None
+    entries = [
+        {'url': entry.get('url') or entry.get('webpage_url'), 'title': entry.get('title'), 'duration': entry.get('duration'),
+         'id': entry.get('id'), 'ie_key': entry.get('ie_key')}
+        for entry in info_dict.get('entries') or [] if entry
+    ]
+    return {'title': info_dict.get('title'), 'count': info_dict.get('playlist_count'), 'entries': [entry for entry in entries if entry['url']]}
+
+async def extract_metadata(link):
+    """
+    Returns the info_dict for a link. Results are cached for METADATA_CACHE_TTL seconds, and
+    concurrent calls for the same link share one in-flight extraction.
+    """
+    info_dict = metadata_cache.get(link)
+    if info_dict is not _MISSING: return info_dict
+
+    task = _inflight_extractions.get(link)
+    if task is None:
+        epoch = metadata_cache.epoch
+        task = _inflight_extractions[link] = asyncio.ensure_future(_timed_extract(link))
+
+        def _done(t):
+            _inflight_extractions.pop(link, None)
+            if not t.cancelled() and t.exception() is None: metadata_cache.set(link, t.result(), epoch)
+        task.add_done_callback(_done)
+    return await asyncio.shield(task)
+
+async def _timed_extract(link):
+    with metrics.timer("bot_stage_seconds", stage="extract"):
+        return await ytdlp_executor.extract(link)
+
+class _DownloadLogger:
+    """Prints yt-dlp's output like its default logger, noting when a file was skipped for exceeding max_filesize."""
+    def __init__(self):
+        self.over_size_limit = False
+
+    def debug(self, message):
+        if 'larger than max-filesize' in message: self.over_size_limit = True
+        if not message.startswith('[debug] '): print(message, flush=True)
+
+    info = debug
+
+    def warning(self, message):
+        print(message, file=sys.stderr, flush=True)
+
+    error = warning
+
+def _download_blocking(ydl_opts, link, info_dict=None):
+    """
+    Downloads a link, reusing a preview-time info_dict to skip the second extraction when possible.
+    yt-dlp skips a file over max_filesize without an error; that raises DownloadTooLarge here.
+    """
+    logger = _DownloadLogger()
+    with yt_dlp.YoutubeDL({**ydl_opts, 'logger': logger}) as ydl:
+        result = None
+        if info_dict:
+            try:
+                result = ydl.process_ie_result(ydl.sanitize_info(info_dict), download=True)
+            except yt_dlp.utils.DownloadError as e:
+                # Format URLs can expire between preview and download; re-extract in that case.
+                LOGGER.warning(f"Download from cached metadata failed for {link}, re-extracting: {e}")
+        if result is None: result = ydl.extract_info(link, download=True)
+    if logger.over_size_limit:
+        raise DownloadTooLarge(f"The video is over the {humanbytes(ydl_opts['max_filesize'])} size limit.")
+    return result
+
+# ============== FORMAT PLANNING =========================================== #
+FormatPlan = namedtuple("FormatPlan", ["selector", "estimated_bytes", "merge"])
+
+def estimate_format_size(fmt, duration):
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if not size and fmt.get('tbr') and duration:
+        size = fmt['tbr'] * 1000 / 8 * duration  # tbr is in kbit/s
+    return int(size) if size else None
+
+def plan_format(info_dict, budget=MAX_DOWNLOAD_SIZE):
+    """
+    Picks the best format that fits `budget` (and Telegram's upload limit) from a preview-time
+    info_dict. At equal height a pre-muxed stream wins over a video+audio pair, since it needs
+    no ffmpeg merge. The choice is made among the options with a known size; its selector is
+    None if all of them are over budget (estimated_bytes is then the smallest option). An
+    unsized pre-muxed stream at least as tall as the pick is tried first, under size filters.
+    With no sizes at all it falls back to a size-filtered VIDEO_FORMAT of unknown size. The
+    download stage's max_filesize catches anything the filters let through.
+    """
+    budget = min(budget, TELEGRAM_UPLOAD_LIMIT)
+    duration = info_dict.get('duration') or 0
+    muxed, video_only, audio_only = [], [], []
+    for fmt in info_dict.get('formats') or [info_dict]:
+        has_video, has_audio = fmt.get('vcodec') != 'none', fmt.get('acodec') != 'none'
+        if has_video and (fmt.get('height') or 0) > MAX_VIDEO_HEIGHT: continue
+        entry = (fmt, estimate_format_size(fmt, duration))
+        if has_video and has_audio: muxed.append(entry)
+        elif has_video and fmt.get('ext') == 'mp4': video_only.append(entry)
+        elif has_audio and fmt.get('ext') == 'm4a': audio_only.append(entry)
+
+    # (rank, selector, size, merge); rank = (height, no merge needed, mp4, bitrate)
+    candidates = [
+        ((f.get('height') or 0, True, f.get('ext') == 'mp4', f.get('tbr') or 0), f.get('format_id') or 'best', size, False)
+        for f, size in muxed
+    ]
+    for v, v_size in video_only:
+        for a, a_size in audio_only:
+            size = v_size + a_size if v_size and a_size else None
+            rank = (v.get('height') or 0, False, True, (v.get('tbr') or 0) + (a.get('tbr') or 0))
+            candidates.append((rank, f"{v['format_id']}+{a['format_id']}", size, True))
+
+    sized = [c for c in candidates if c[2]]
+    if not sized:
+        return FormatPlan(within_budget(VIDEO_FORMAT, budget), None, True)
+    fitting = [c for c in sized if c[2] <= budget]
+    if not fitting:
+        return FormatPlan(None, min(c[2] for c in sized), False)
+    rank, selector, size, merge = max(fitting, key=lambda c: c[0])
+    unsized_muxed = [c for c in candidates if not c[2] and not c[3] and c[0][0] >= rank[0]]
+    if merge and unsized_muxed:
+        muxed_selector = max(unsized_muxed, key=lambda c: c[0])[1]
+        return FormatPlan(f"{within_budget(muxed_selector, budget)}/{selector}", size, True)
+    return FormatPlan(selector, size, merge)
+
+def within_budget(selector, budget):
+    """Adds size filters to every format in a yt-dlp selector; formats of unknown size still pass (`<?`)."""
+    size_filter = f"[filesize<?{budget}][filesize_approx<?{budget}]"
+    return "/".join("+".join(part + size_filter for part in alternative.split("+")) for alternative in selector.split("/"))
+
+def admission_error(plan, budget=MAX_DOWNLOAD_SIZE):
+    """Pre-flight check before any bandwidth is spent. Returns a user-facing reason, or None if the job may run."""
+    if plan.selector is None:
+        return f"Even the smallest available format is about `{humanbytes(plan.estimated_bytes)}`, over the `{humanbytes(min(budget, TELEGRAM_UPLOAD_LIMIT))}` limit."
+    if plan.estimated_bytes:
+        # A merge briefly needs room for both the streams and the merged output.
+        return storage.admission_error(plan.estimated_bytes * (2 if plan.merge else 1))
+    return None
+
+# ============== STORAGE MANAGER =========================================== #
+SWEEPABLE_SUFFIXES = ('.mp4', '.jpg', '.part', '.ytdl', '.m4a', '.webm', '.mkv', '.temp')
+
+class StorageManager:
+    """
+    Admission control for download space. Before a job starts it reserves its estimated size
+    (twice that when streams must be merged); it is only admitted while all reservations fit
+    STORAGE_QUOTA and the disk keeps STORAGE_MIN_FREE spare. Small jobs run from the optional
+    fast SCRATCH_PATH. Job files that no live job owns are swept at startup and periodically.
+    """
+    def __init__(self, path=DOWNLOAD_PATH, scratch_path=SCRATCH_PATH, quota=STORAGE_QUOTA, min_free=STORAGE_MIN_FREE):
+        self.path, self.scratch_path, self.quota, self.min_free = path, scratch_path, quota, min_free
+        self.reservations = {}  # download_id -> (bytes, directory)
+        self.swept_files = self.swept_bytes = 0
+
+    @property
+    def dirs(self):
+        return [directory for directory in (self.scratch_path, self.path) if directory]
+
+    @property
+    def reserved(self):
+        return sum(nbytes for nbytes, _ in self.reservations.values())
+
+    @staticmethod
+    def estimate(job):
+        nbytes = job.estimated_bytes or STORAGE_DEFAULT_RESERVATION
+        return nbytes * 2 if job.format and '+' in job.format else nbytes
+
+    @staticmethod
+    def usage(directory):
+        if not os.path.isdir(directory): return 0
+        return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    def _available(self, directory):
+        """Free space in `directory` once outstanding reservations there are written out."""
+        reserved_here = sum(nbytes for nbytes, d in self.reservations.values() if d == directory)
+        outstanding = max(0, reserved_here - self.usage(directory))
+        return psutil.disk_usage(directory).free - outstanding
+
+    def admission_error(self, nbytes):
+        """User-facing reason why a job of `nbytes` can never be admitted, or None."""
+        if nbytes > self.quota:
+            return f"This video needs about `{humanbytes(nbytes)}` of working space, more than the `{humanbytes(self.quota)}` download quota."
+        if nbytes > psutil.disk_usage(self.path).free + self.reserved - self.min_free:
+            return f"Not enough free disk space for this video (needs about `{humanbytes(nbytes)}`). Please try again later."
+        return None
+
+    def _choose_dir(self, job, nbytes):
+        # A resumed job stays where its partial files already are.
+        for directory in self.dirs:
+            if glob.glob(os.path.join(glob.escape(directory), f"{job.download_id}.*")): return directory
+        if self.scratch_path and nbytes <= SCRATCH_MAX_FILE and self._available(self.scratch_path) >= nbytes:
+            return self.scratch_path
+        return self.path
+
+    def try_reserve(self, job):
+        """Reserves space for a job about to start. Returns False if it must wait for space."""
+        nbytes = self.estimate(job)
+        directory = self._choose_dir(job, nbytes)
+        headroom = self.min_free if directory == self.path else 0
+        fits_quota = self.reserved + nbytes <= self.quota
+        fits_disk = self._available(directory) - nbytes >= headroom
+        # With nothing else reserved, a job admitted under an older quota must not wait forever; the disk check always applies.
+        if fits_disk and (fits_quota or not self.reservations):
+            self.reservations[job.download_id] = (nbytes, directory)
+            return True
+        return False
+
+    def release(self, download_id):
+        self.reservations.pop(download_id, None)
+
+    def dir_of(self, download_id):
+        return self.reservations.get(download_id, (0, self.path))[1]
+
+    async def sweep(self):
+        """Deletes job files in the download directories that belong to no queued or running job."""
+        live = {str(row[0]) for row in await db.fetchall("SELECT id FROM jobs")} | set(active_downloads)
+        cutoff = time.time() - 60
+
+        def _sweep():
+            removed = freed = 0
+            for directory in self.dirs:
+                if not os.path.isdir(directory): continue
+                for entry in os.scandir(directory):
+                    if not entry.is_file() or not entry.name.endswith(SWEEPABLE_SUFFIXES): continue
+                    if entry.name.split('.', 1)[0] in live: continue
+                    stat = entry.stat()
+                    if stat.st_mtime > cutoff: continue
+                    try: os.remove(entry.path)
+                    except OSError: continue
+                    removed, freed = removed + 1, freed + stat.st_size
+            return removed, freed
+
+        removed, freed = await asyncio.to_thread(_sweep)
+        self.swept_files, self.swept_bytes = self.swept_files + removed, self.swept_bytes + freed
+        if removed: LOGGER.info(f"Swept {removed} orphaned file(s), freed {humanbytes(freed)}.")
+
+    async def sweep_forever(self):
+        while True:
+            await asyncio.sleep(STORAGE_SWEEP_INTERVAL)
+            try: await self.sweep()
+            except Exception as e: LOGGER.warning(f"Storage sweep failed: {e}")
+            scheduler.wake()
+
+storage = StorageManager()
+
+# ============== YT-DLP EXECUTION ENGINE =================================== #
+class TaskCancelled(Exception):
+    """Raised when a yt-dlp task is cancelled before it finishes."""
+
+class DownloadTooLarge(Exception):
+    """yt-dlp skipped a download because the file is larger than max_filesize."""
+
+class WorkerTaskError(Exception):
+    """A yt-dlp task failed inside a worker process; carries the original error message and exception name."""
+    def __init__(self, message, kind=None):
+        super().__init__(message)
+        self.kind = kind
+
+class ThreadExecutor:
+    """Runs yt-dlp on the default thread pool. A cancel takes effect at the task's next progress callback."""
+    def __init__(self):
+        self._cancel_events = {}
+
+    async def extract(self, link):
+        return await asyncio.to_thread(_extract_blocking, link)
+
+    async def extract_page(self, link, start, end):
+        return await asyncio.to_thread(_extract_page_blocking, link, start, end)
+
+    async def warm_up(self):
+        await asyncio.to_thread(_preload_ytdlp)
+
+    async def download(self, task_id, ydl_opts, link, info_dict=None):
+        cancel_event = self._cancel_events[task_id] = threading.Event()
+
+        def cancel_hook(d):
+            if cancel_event.is_set(): raise yt_dlp.utils.DownloadCancelled()
+
+        ydl_opts = {**ydl_opts, 'progress_hooks': [cancel_hook, *ydl_opts.get('progress_hooks', [])]}
+        try:
+            return await asyncio.to_thread(_download_blocking, ydl_opts, link, info_dict)
+        except yt_dlp.utils.DownloadCancelled:
+            raise TaskCancelled(task_id)
+        finally:
+            self._cancel_events.pop(task_id, None)
+
+    async def cancel(self, task_id):
+        cancel_event = self._cancel_events.get(task_id)
+        if cancel_event: cancel_event.set()
+        return cancel_event is not None
+
+    async def shutdown(self):
+        for cancel_event in self._cancel_events.values(): cancel_event.set()
+
+@dataclass
+class YtdlpWorker:
+    process: multiprocessing.Process
+    conn: object
+
+def _ytdlp_worker_main(conn):
+    """Worker-process loop: serves extract/extract_page/warm_up/download requests from the parent until its pipe closes."""
+    # Own process group, so a cancel can kill this worker together with any ffmpeg it started.
+    if hasattr(os, "setpgrp"): os.setpgrp()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    last_progress = 0
+
+    def progress_hook(d):
+        nonlocal last_progress
+        now = time.monotonic()
+        if d['status'] == 'downloading' and now - last_progress < WORKER_PROGRESS_INTERVAL: return
+        last_progress = now
+        conn.send(('progress', {key: d.get(key) for key in ('status', 'downloaded_bytes', 'total_bytes', 'total_bytes_estimate', 'filename', 'tmpfilename')}))
+
+    def postprocessor_hook(d):
+        conn.send(('postprocess', {'status': d.get('status'), 'postprocessor': d.get('postprocessor')}))
+
+    while True:
+        try: kind, args, trace_id = conn.recv()
+        except (EOFError, OSError): return
+        trace_id_var.set(trace_id)
+        try:
+            if kind == 'extract':
+                result = yt_dlp.YoutubeDL.sanitize_info(_extract_blocking(*args))
+            elif kind == 'extract_page':
+                result = _extract_page_blocking(*args)
+            elif kind == 'warm_up':
+                result = _preload_ytdlp()
+            else:
+                ydl_opts, link, info_dict = args
+                _download_blocking({**ydl_opts, 'progress_hooks': [progress_hook], 'postprocessor_hooks': [postprocessor_hook]}, link, info_dict)
+                result = None
+            conn.send(('result', result))
+        except Exception as e:
+            conn.send(('error', (str(e), type(e).__name__)))
+
+class ProcessExecutor:
+    """
+    Runs yt-dlp in a pool of long-lived worker processes, keeping extraction and fragment
+    handling off the bot's GIL. Progress streams back over each worker's pipe. Cancelling a
+    task kills its worker outright; a replacement is spawned on the next request. Downloads
+    hold at most size - reserved workers, leaving the rest free for extractions.
+    """
+    def __init__(self, size=YTDLP_WORKER_PROCESSES, reserved=YTDLP_EXTRACT_RESERVED):
+        self.size = size
+        self._ctx = multiprocessing.get_context("spawn")
+        self._slots = asyncio.Semaphore(size)
+        self._download_slots = asyncio.Semaphore(max(1, size - reserved))
+        self._idle = deque()
+        self._waiting, self._running, self._cancelled = set(), {}, set()
+
+    def _spawn(self):
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(target=_ytdlp_worker_main, args=(child_conn,), name="ytdlp-worker", daemon=True)
+        process.start()
+        child_conn.close()
+        return YtdlpWorker(process, parent_conn)
+
+    @staticmethod
+    def _kill(worker):
+        try:
+            if hasattr(os, "killpg"): os.killpg(worker.process.pid, signal.SIGKILL)
+            else: worker.process.kill()
+        except (ProcessLookupError, PermissionError):
+            worker.process.kill()
+
+    @staticmethod
+    def _discard(worker):
+        worker.conn.close()
+        worker.process.join(timeout=1)
+
+    @staticmethod
+    def _pump(worker, hooks):
+        """Blocking: relays progress/postprocess messages to their hooks until the worker sends its final reply."""
+        while True:
+            kind, payload = worker.conn.recv()
+            if kind not in hooks: return kind, payload
+            for hook in hooks[kind]:
+                try: hook(payload)
+                except Exception as e: LOGGER.warning(f"Progress hook failed: {e}")
+
+    async def _run(self, task_id, request, hooks=None, slots=None):
+        if task_id: self._waiting.add(task_id)
+        try:
+            async with slots or nullcontext(), self._slots:
+                self._waiting.discard(task_id)
+                if task_id in self._cancelled: raise TaskCancelled(task_id)
+                worker = self._idle.popleft() if self._idle else await asyncio.to_thread(self._spawn)
+                if task_id: self._running[task_id] = worker
+                try:
+                    worker.conn.send(request)
+                    kind, payload = await asyncio.to_thread(self._pump, worker, hooks or {})
+                except (EOFError, OSError):
+                    self._discard(worker)
+                    if task_id in self._cancelled: raise TaskCancelled(task_id)
+                    raise WorkerTaskError("The download worker exited unexpectedly.")
+                finally:
+                    self._running.pop(task_id, None)
+                self._idle.append(worker)
+        finally:
+            self._waiting.discard(task_id)
+            self._cancelled.discard(task_id)
+        if kind == 'error': raise WorkerTaskError(*payload)
+        return payload
+
+    async def extract(self, link):
+        return await self._run(None, ('extract', (link,), trace_id_var.get()))
+
+    async def extract_page(self, link, start, end):
+        return await self._run(None, ('extract_page', (link, start, end), trace_id_var.get()))
+
+    async def warm_up(self):
+        """Spawns the whole pool up front and has each worker preload yt-dlp."""
+        await asyncio.gather(*(self._run(None, ('warm_up', (), trace_id_var.get())) for _ in range(self.size)))
+
+    async def download(self, task_id, ydl_opts, link, info_dict=None):
+        hooks = {'progress': ydl_opts.get('progress_hooks', []), 'postprocess': ydl_opts.get('postprocessor_hooks', [])}
+        ydl_opts = {key: value for key, value in ydl_opts.items() if key not in ('progress_hooks', 'postprocessor_hooks')}
+        return await self._run(task_id, ('download', (ydl_opts, link, info_dict), trace_id_var.get()), hooks, self._download_slots)
+
+    async def cancel(self, task_id):
+        if task_id not in self._running and task_id not in self._waiting: return False
+        self._cancelled.add(task_id)
+        worker = self._running.get(task_id)
+        if worker: self._kill(worker)
+        return True
+
+    async def shutdown(self):
+        for worker in self._running.values(): self._kill(worker)
+        while self._idle: self._discard(self._idle.popleft())
+
+ytdlp_executor = ProcessExecutor() if YTDLP_EXECUTOR == "process" else ThreadExecutor()
+
+TRANSIENT_ERROR_MARKERS = (
+    "timed out", "timeout", "connection", "reset by peer", "temporary failure", "network is unreachable",
+    "remote end closed", "incompleteread", "http error 5", "unable to download video data", "exited unexpectedly",
+)
+
+def is_transient_error(e):
+    """Best-effort check for network-level failures worth retrying (worker errors only carry a message)."""
+    if isinstance(e, (asyncio.TimeoutError, ConnectionError)): return True
+    message = str(e).lower()
+    return any(marker in message for marker in TRANSIENT_ERROR_MARKERS)
+
+def remove_job_files(download_id):
+    """Deletes everything a job left in the download directories: the output and any .part/fragment files."""
+    for directory in storage.dirs:
+        for path in glob.glob(os.path.join(glob.escape(directory), f"{glob.escape(download_id)}.*")):
+            try: os.remove(path)
+            except OSError as e: LOGGER.warning(f"Could not remove {path}: {e}")
+
+# ============== PENDING CONFIRMATIONS ===================================== #
+class ConfirmationStore:
+    """
+    Pending "Confirm Download" cards, keyed by `user_id:message_id`. Records are LinkData
+    tuples with the title cut to TITLE_LIMIT characters, held in a bounded TTL cache; expired
+    entries are swept periodically. With `persist`, cards are also written to the
+    pending_confirmations table, so a button pressed after a restart (or after the card fell
+    out of memory) still works until it expires.
+    """
+    TITLE_LIMIT = 128
+
+    def __init__(self, max_entries=CONFIRMATION_MAX_ENTRIES, ttl=CONFIRMATION_TTL, persist=CONFIRMATION_PERSIST):
+        self.ttl, self.persist = ttl, persist
+        self._cache = TTLCache(max_entries, ttl)
+        self.restored = self.swept = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    @property
+    def evictions(self):
+        return self._cache.evictions
+
+    async def put(self, data_key, link_data):
+        link_data = link_data._replace(title=shorten(link_data.title or "", self.TITLE_LIMIT))
+        self._cache.set(data_key, link_data)
+        if self.persist:
+            await db.execute(
+                "INSERT OR REPLACE INTO pending_confirmations (data_key, link, title, duration, thumb_url, original_message_id, media_key, format, "
+                "estimated_bytes, trace_id, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (data_key, *link_data, time.time() + self.ttl)
+            )
+
+    async def pop(self, data_key):
+        """
+        Removes and returns a pending card's LinkData, or None if it expired or was never stored.
+        With `persist`, the row is claimed in one write, so of two concurrent taps only the one
+        that deleted it gets the card.
+        """
+        link_data = self._cache.pop(data_key)
+        if not self.persist: return link_data
+        now = time.time()
+
+        def _claim(conn):
+            row = conn.execute(
+                "SELECT link, title, duration, thumb_url, original_message_id, media_key, format, estimated_bytes, trace_id "
+                "FROM pending_confirmations WHERE data_key = ? AND expires_at > ?", (data_key, now)
+            ).fetchone()
+            deleted = conn.execute("DELETE FROM pending_confirmations WHERE data_key = ?", (data_key,)).rowcount
+            return row if deleted else None
+        row = await db.write(_claim)
+        if row is None: return None
+        if link_data is None: self.restored += 1
+        return link_data or LinkData(*row)
+
+    async def sweep(self):
+        self.swept += self._cache.purge_expired()
+        if self.persist:
+            self.swept += await db.execute("DELETE FROM pending_confirmations WHERE expires_at <= ?", (time.time(),))
+
+    async def stored(self):
+        if not self.persist: return len(self)
+        return await db.fetchval("SELECT COUNT(*) FROM pending_confirmations", default=0)
+
+    async def sweep_forever(self):
+        while True:
+            await asyncio.sleep(CONFIRMATION_SWEEP_INTERVAL)
+            try: await self.sweep()
+            except Exception as e: LOGGER.warning(f"Confirmation sweep failed: {e}")
+
+confirmations = ConfirmationStore()
+
 # ============== LINK HANDLING & DOWNLOAD ================================== #
-@app.on_message(filters.regex(r'https?://[^\s]+') & filters.private & verified_user_filter)
+@app.on_message(filters.regex(r'https?://[^\s]+') & ~filters.command("batch") & filters.private & verified_user_filter & admission_filter)
 async def link_handler(client, message):
     link, user_id = message.text, message.from_user.id
-    
-    if len(active_downloads) >= MAX_CONCURRENT_DOWNLOADS:
-        await message.reply_text("Busy with other downloads. Please try again in a moment.")
-        return
         
+    trace_token = trace_id_var.set(new_trace_id())
+    try:
+        await preview_link(client, message, link, user_id)
+    finally:
+        trace_id_var.reset(trace_token)
+        admission.release(user_id)
+
+async def preview_link(client, message, link, user_id):
     processing_msg = await message.reply_text("🔎 `Extracting video information...`", quote=True)
     
     try:
-        ydl_opts = {'noplaylist': True, 'quiet': True, 'no_warnings': True, 'forcejson': True}
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info_dict = await asyncio.to_thread(ydl.extract_info, link, download=False)
+        info_dict = await extract_metadata(link)
         
         title, thumb_url, duration = info_dict.get('title', 'N/A'), info_dict.get('thumbnail'), info_dict.get('duration', 0)
-        short_title = (title[:70] + '...') if len(title) > 70 else title
+        short_title = shorten(title, 70)
         data_key = f"{user_id}:{processing_msg.id}"
-        link_cache[data_key] = (link, title, duration, thumb_url, message.id)
+        plan = plan_format(info_dict)
+        rejection = admission_error(plan)
+        if rejection:
+            return await processing_msg.edit_text(f"🚫 **Cannot Download:** {rejection}")
+        await confirmations.put(data_key, LinkData(
+            link, title, duration, thumb_url, message.id, media_key_for(info_dict, link, plan.selector), plan.selector, plan.estimated_bytes, trace_id_var.get()
+        ))
 
         keyboard = InlineKeyboardMarkup([
             [InlineKeyboardButton("✅ Confirm Download", callback_data=f"confirm_{data_key}")],
             [InlineKeyboardButton("❌ Cancel", callback_data=f"cancel_op_{data_key}")],
         ])
-        caption = f"**🏷️ Title:** `{short_title}`\n\n**⏱️ Duration:** `{time_formatter(duration)}`\n\nReady to download?"
+        size_text = f"~{humanbytes(plan.estimated_bytes)}" if plan.estimated_bytes else "Unknown"
+        caption = f"**🏷️ Title:** `{short_title}`\n\n**⏱️ Duration:** `{time_formatter(duration)}`\n**💾 Size:** `{size_text}`\n\nReady to download?"
         
+        # Telegram would otherwise fetch the remote URL itself; the local copy also warms the cache for the download stage.
+        thumb_path = await thumbnails.get(thumb_url)
         await processing_msg.delete()
-        if thumb_url:
-            await client.send_photo(user_id, photo=thumb_url, caption=caption, reply_markup=keyboard, has_spoiler=True)
+        if thumb_path or thumb_url:
+            await client.send_photo(user_id, photo=thumb_path or thumb_url, caption=caption, reply_markup=keyboard, has_spoiler=True)
         else:
             await client.send_message(user_id, text=caption, reply_markup=keyboard)
             
     except Exception as e:
         LOGGER.error(f"Error processing link {link}: {e}", exc_info=True)
+        metrics.inc("bot_errors_total", stage="extract", type=error_type(e), extractor=extractor_of(None, link))
         await processing_msg.edit_text(f"🚫 **Error:** Failed to process the link. It might be invalid, private, or from an unsupported site.")
 
 @app.on_callback_query(filters.regex("^(confirm|cancel_op)_"))
@@ -238,125 +2299,639 @@ async def confirmation_callback(client, callback_query):
     action, data_key = callback_query.data.split("_", 1)
 
     if action == "cancel_op":
-        link_cache.pop(data_key, None)
+        await confirmations.pop(data_key)
         await callback_query.message.delete()
         return await callback_query.answer("Download cancelled.")
 
-    if len(active_downloads) >= MAX_CONCURRENT_DOWNLOADS:
-        return await callback_query.answer("Bot is currently busy with other downloads. Please try again in a moment.", show_alert=True)
-        
-    link_data = link_cache.pop(data_key, None)
+    link_data = await confirmations.pop(data_key)
     if not link_data:
         await callback_query.message.delete()
         return await callback_query.answer("This download confirmation has expired. Please send the link again.", show_alert=True)
 
     await callback_query.message.delete()
-    status_message = await client.send_message(user_id, "🚀 `Your download is starting...`")
-    asyncio.create_task(download_and_upload(user_id, link_data, status_message))
+    link, title, duration, _, _, media_key, _, _, _ = link_data
+    if await send_cached_video(user_id, media_key, title, duration):
+        metrics.inc("bot_jobs_total", outcome="cached")
+        return
+
+    status_message = await client.send_message(user_id, "⏳ `Your download has been queued...`")
+    await scheduler.submit(user_id, link_data, status_message)
 
-async def download_and_upload(user_id, link_data, message):
-    link, title, duration, thumb_url, original_message_id = link_data
-    download_id = f"{user_id}-{int(time.time())}"
+def record_outcome(job, outcome):
+    job.outcome = outcome
+    metrics.inc("bot_jobs_total", outcome=outcome)
+
+async def download_and_upload(job):
+    """
+    Runs one job; the scheduler holds a download slot for it until release_download_slot().
+    Returns a retry delay in seconds if the job should be re-queued, otherwise None.
+    """
+    user_id, message, download_id = job.user_id, job.message, job.download_id
+    link, title, duration, thumb_url, original_message_id, media_key, _, _, _ = job.link_data
     active_downloads.add(download_id)
     
-    start_time, last_update_time = time.time(), 0
-    download_filepath = os.path.join(DOWNLOAD_PATH, f"{download_id}.mp4")
-    thumb_filepath = os.path.join(DOWNLOAD_PATH, f"{download_id}.jpg")
-    short_title = (title[:60] + '...') if len(title) > 60 else title
-
-    async def update_status_message(stage, current=0, total=1):
-        nonlocal last_update_time
-        now = time.time()
-        if now - last_update_time < 2: return
-        last_update_time = now
-        
-        percentage = (current / total) * 100 if total > 0 else 0
-        progress_bar = get_progress_bar(percentage)
-        elapsed_time = time.time() - start_time
-        speed = current / elapsed_time if elapsed_time > 0 else 0
-        eta = (total - current) / speed if speed > 0 else 0
-        
-        header = f"📥 **Downloading...**" if stage == 'download' else "☁️ **Uploading...**"
-        
-        details = (
-            f"**Progress:** `{progress_bar} {percentage:.1f}%`\n"
-            f"**Status:** `{humanbytes(current)}` of `{humanbytes(total)}`\n"
-            f"**Speed:** `{humanbytes(speed)}/s`\n"
-            f"**ETA:** `{time_formatter(int(eta))}`"
-        )
-        
-        keyboard = InlineKeyboardMarkup([[
-            InlineKeyboardButton("✖️ Cancel", callback_data=f"cancel_dl_{download_id}")
-        ]])
-        
-        try:
-            await message.edit_text(f"{header}\n\n**🏷️** `{short_title}`\n\n{details}", reply_markup=keyboard)
-        except (MessageNotModified, FloodWait): pass
-        except Exception as e: LOGGER.warning(f"Status update failed: {e}")
+    download_filepath = os.path.join(storage.dir_of(download_id), f"{download_id}.mp4")
+    short_title = shorten(title, 60)
+    stage, retry_after = 'download', None
+    status_updates.track(download_id, message, short_title)
 
     def ydl_hook(d):
         if d['status'] == 'downloading':
-            total, downloaded = d.get('total_bytes_estimate', 0), d['downloaded_bytes']
-            if app.loop.is_running(): asyncio.run_coroutine_threadsafe(update_status_message('download', downloaded, total), app.loop)
+            total, downloaded = d.get('total_bytes') or d.get('total_bytes_estimate') or 0, d['downloaded_bytes']
+            job.bytes_done, job.partial_path = downloaded, d.get('tmpfilename') or d.get('filename')
+            status_updates.report(download_id, 'download', downloaded, total)
 
     def upload_hook(current, total):
-        if app.loop.is_running(): asyncio.run_coroutine_threadsafe(update_status_message('upload', current, total), app.loop)
+        status_updates.report(download_id, 'upload', current, total)
+
+    merge_started = None
+    def postprocessor_hook(d):
+        nonlocal merge_started
+        if d.get('postprocessor') != 'Merger': return
+        if d['status'] == 'started': merge_started = time.perf_counter()
+        elif d['status'] == 'finished' and merge_started is not None:
+            metrics.observe("bot_stage_seconds", time.perf_counter() - merge_started, stage="merge")
 
     try:
-        ydl_opts = {'outtmpl': download_filepath, 'progress_hooks': [ydl_hook], 'noplaylist': True, 'format': 'bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]/best[height<=720][ext=mp4]/best', 'merge_output_format': 'mp4', 'nocheckcertificate': True}
-        await asyncio.to_thread(yt_dlp.YoutubeDL(ydl_opts).extract_info, link, download=True)
-            
+        # Another job for the same media may have finished while this one was queued.
+        if await send_cached_video(user_id, media_key, title, duration, recheck=True):
+            record_outcome(job, "cached")
+            await message.delete()
+            return
+
+        if job.bytes_done:
+            await status_updates.begin_stage(download_id)
+            await status_updates.edit(message, f"🔁 **Resuming download...**\n\n**🏷️** `{short_title}`\n\n`{humanbytes(job.bytes_done)}` already downloaded.")
+
+        # The output path only depends on the job id, so yt-dlp continues any .part/fragment files a previous attempt left.
+        ydl_opts = {
+            'outtmpl': download_filepath, 'progress_hooks': [ydl_hook], 'postprocessor_hooks': [postprocessor_hook], 'noplaylist': True, 'format': job.format or VIDEO_FORMAT,
+            'merge_output_format': 'mp4', 'nocheckcertificate': True, 'max_filesize': min(MAX_DOWNLOAD_SIZE, TELEGRAM_UPLOAD_LIMIT),
+            'continuedl': True, 'retries': DOWNLOAD_RETRIES, 'fragment_retries': DOWNLOAD_RETRIES
+        }
+        # The thumbnail is fetched (or read from cache) while the video downloads.
+        thumb_task = asyncio.ensure_future(thumbnails.get(thumb_url))
+        info_dict = metadata_cache.get(link, None)
+        if download_id not in cancelled_downloads:
+            started = time.perf_counter()
+            try: await ytdlp_executor.download(download_id, ydl_opts, link, info_dict)
+            except TaskCancelled: pass
+            else: metrics.observe("bot_stage_seconds", time.perf_counter() - started, stage="download")
+
         if download_id in cancelled_downloads:
-            await message.edit_text(f"❌ **Download Canceled**\n\nYour request for `{short_title}` was successfully canceled.")
+            record_outcome(job, "cancelled")
+            await status_updates.untrack(download_id)
+            await status_updates.edit(message, f"❌ **Download Canceled**\n\nYour request for `{short_title}` was successfully canceled.")
             return
 
         if not os.path.exists(download_filepath): raise FileNotFoundError("Downloaded file not found.")
+        file_size = os.path.getsize(download_filepath)
+        metrics.inc("bot_bytes_total", file_size, direction="download")
 
-        if thumb_url:
-            async with aiohttp.ClientSession() as session, session.get(thumb_url) as resp:
-                if resp.status == 200:
-                    with open(thumb_filepath, "wb") as f: f.write(await resp.read())
-                else: thumb_filepath = None
-        else: thumb_filepath = None
+        thumb_filepath = await thumb_task
 
-        await message.edit_text("✅ `Download complete!`\n\n☁️ `Preparing to upload...`")
+        stage = 'upload'
+        scheduler.release_download_slot(job)
+        await status_updates.begin_stage(download_id)
+        await status_updates.edit(message, "✅ `Download complete!`\n\n☁️ `Preparing to upload...`")
         
-        caption_text = f"🎬 **{title}**"
-        if SELF_DESTRUCT_TIMER > 0: caption_text += f"\n\n_🗑️ This video will be deleted in {time_formatter(SELF_DESTRUCT_TIMER)}._"
-            
-        sent_video = await app.send_video(user_id, video=download_filepath, caption=caption_text, thumb=thumb_filepath, duration=duration, progress=upload_hook, has_spoiler=True)
+        async with scheduler.upload_slots:
+            if download_id in cancelled_downloads:
+                record_outcome(job, "cancelled")
+                await status_updates.untrack(download_id)
+                await status_updates.edit(message, f"❌ **Download Canceled**\n\nYour request for `{short_title}` was successfully canceled.")
+                return
+            await set_job_state(job, 'uploading')
+            await status_updates.begin_stage(download_id)
+            started = time.perf_counter()
+            sent_video = await app.send_video(user_id, video=download_filepath, caption=video_caption(title), thumb=thumb_filepath, duration=duration, progress=upload_hook, has_spoiler=True)
+            metrics.observe("bot_stage_seconds", time.perf_counter() - started, stage="upload")
+        metrics.inc("bot_bytes_total", file_size, direction="upload")
+        record_outcome(job, "done")
         
         await message.delete()
         LOGGER.info(f"Upload finished for user {user_id}.")
+        await media_cache.store(media_key, sent_video.video)
         
         if SELF_DESTRUCT_TIMER > 0:
-            await asyncio.sleep(SELF_DESTRUCT_TIMER)
-            await sent_video.delete()
-            LOGGER.info(f"Self-destructed video for user {user_id}.")
+            asyncio.create_task(self_destruct(sent_video, user_id))
 
     except Exception as e:
-        LOGGER.error(f"Download/Upload error for {user_id}: {e}", exc_info=True)
-        error_message = str(e).replace('ERROR: ', '')
-        await message.edit_text(f"🚫 **An Error Occurred:**\n`{error_message}`\nPlease try another link.")
+        await status_updates.untrack(download_id)
+        metrics.inc("bot_errors_total", stage=stage, type=error_type(e), extractor=extractor_of(media_key, link))
+        if stage == 'download' and is_transient_error(e) and job.attempts < JOB_MAX_RETRIES:
+            record_outcome(job, "retry")
+            job.attempts += 1
+            retry_after = JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1)
+            LOGGER.warning(f"Transient download error for job {job.id} (attempt {job.attempts}/{JOB_MAX_RETRIES}), retrying in {retry_after}s: {e}")
+            keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("✖️ Cancel", callback_data=f"cancel_dl_{download_id}")]])
+            await status_updates.edit(
+                message,
+                f"⚠️ **Connection problem**\n\n**🏷️** `{short_title}`\n\nRetrying in `{time_formatter(retry_after)}` "
+                f"(attempt {job.attempts}/{JOB_MAX_RETRIES}). `{humanbytes(job.bytes_done)}` downloaded so far will be kept.",
+                keyboard
+            )
+        else:
+            record_outcome(job, "failed")
+            if error_type(e) == 'DownloadTooLarge':
+                LOGGER.warning(f"Job {job.id} skipped by yt-dlp: {e}")
+                await status_updates.edit(message, f"🚫 **Too Large:** `{short_title}`\n\nThe video is over the `{humanbytes(min(MAX_DOWNLOAD_SIZE, TELEGRAM_UPLOAD_LIMIT))}` limit.")
+            else:
+                LOGGER.error(f"Download/Upload error for {user_id}: {e}", exc_info=True)
+                error_message = str(e).replace('ERROR: ', '')
+                await status_updates.edit(message, f"🚫 **An Error Occurred:**\n`{error_message}`\nPlease try another link.")
     finally:
+        await status_updates.untrack(download_id)
         active_downloads.discard(download_id)
         cancelled_downloads.discard(download_id)
-        for f in [download_filepath, thumb_filepath]:
-            if f and os.path.exists(f): os.remove(f)
+        if retry_after is None: remove_job_files(download_id)
+    return retry_after
+
+def video_caption(title):
+    caption_text = f"🎬 **{title}**"
+    if SELF_DESTRUCT_TIMER > 0: caption_text += f"\n\n_🗑️ This video will be deleted in {time_formatter(SELF_DESTRUCT_TIMER)}._"
+    return caption_text
+
+async def self_destruct(sent_video, user_id):
+    await asyncio.sleep(SELF_DESTRUCT_TIMER)
+    try:
+        await sent_video.delete()
+        LOGGER.info(f"Self-destructed video for user {user_id}.")
+    except Exception as e:
+        LOGGER.warning(f"Self-destruct failed for user {user_id}: {e}")
+
+async def cancel_active_download(download_id):
+    """Stops a job running in this process. Returns True if the yt-dlp task was stopped right away."""
+    cancelled_downloads.add(download_id)
+    await status_updates.untrack(download_id)
+    return await ytdlp_executor.cancel(download_id)
 
 @app.on_callback_query(filters.regex("^cancel_dl_"))
 async def cancel_download_handler(client, callback_query):
     download_id = callback_query.data.split("_", 2)[2]
 
-    if download_id in active_downloads:
-        cancelled_downloads.add(download_id)
+    if await scheduler.cancel_queued(download_id):
+        await callback_query.message.edit_text("❌ **Download Canceled**\n\nYour queued request was removed.")
+        await callback_query.answer("Removed from the queue.", show_alert=False)
+    elif download_id in active_downloads:
+        stopped = await cancel_active_download(download_id)
         try:
-            await callback_query.message.edit_text(f"**⚠️ Cancelling Download**\n\nThe process will be stopped after the current operation finishes. Please wait.")
+            if stopped: await callback_query.message.edit_text("**⚠️ Cancelling Download**\n\nStopping the download and cleaning up. Please wait.")
+            else: await callback_query.message.edit_text("**⚠️ Cancelling Download**\n\nThe process will be stopped after the current operation finishes. Please wait.")
+        except MessageNotModified: pass
+        await callback_query.answer("Cancellation request sent.", show_alert=False)
+    elif await scheduler.request_cancel(download_id):
+        # Split mode: the job runs in a worker process, which picks the flag up on its next poll.
+        try: await callback_query.message.edit_text("**⚠️ Cancelling Download**\n\nStopping the download and cleaning up. Please wait.")
         except MessageNotModified: pass
         await callback_query.answer("Cancellation request sent.", show_alert=False)
     else:
         await callback_query.answer("This download is already complete or has been cancelled.", show_alert=True)
 
+# ============== PLAYLIST BATCHES ========================================== #
+@dataclass(eq=False)
+class BatchRun:
+    id: int
+    user_id: int
+    link: str
+    title: str
+    status_message_id: int
+    cursor: int = 0
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    trace_id: str = None
+    status_message: Message = None
+    cancel_requested: bool = False
+    jobs: dict = field(default_factory=dict)  # download_id -> Job, entries submitted and not finished yet
+
+    @property
+    def done(self):
+        return self.sent + self.failed
+
+class BatchEngine:
+    """
+    Opt-in playlist downloads (`/batch <link>`). The playlist is listed lazily with flat
+    extraction, BATCH_PAGE_SIZE entries per page, and confirmed with one card showing the
+    entry count and an estimated total size. Confirmed entries become ordinary jobs, at most
+    `lookahead` at a time, so they get the scheduler's retries, file_id cache and storage
+    accounting; the scheduler lets one entry download while the previous one uploads. Batches
+    live in the `batches` table: `cursor` is the last entry submitted, so a restart resumes
+    with the next one; entries submitted before it are picked up from the scheduler and
+    tracked again.
+    """
+    def __init__(self, lookahead=BATCH_LOOKAHEAD, page_size=BATCH_PAGE_SIZE, max_entries=BATCH_MAX_ENTRIES):
+        self.lookahead, self.page_size, self.max_entries = lookahead, page_size, max_entries
+        self._runs = {}
+
+    def __len__(self):
+        return len(self._runs)
+
+    async def start(self):
+        rows = await db.fetchall(
+            "SELECT id, user_id, link, title, status_message_id, cursor, total, sent, failed, trace_id FROM batches WHERE state = 'running' ORDER BY id"
+        )
+        for row in rows:
+            if row[0] in self._runs: continue
+            run = BatchRun(*row)
+            run.status_message = await restore_status_message(run.user_id, run.status_message_id, "📚 `Resuming your playlist download after a restart...`")
+            if run.status_message is None:
+                LOGGER.warning(f"Cancelling batch {run.id}: user {run.user_id} can't be reached.")
+                await self._checkpoint(run, 'cancelled')
+                continue
+            run.jobs = {job.download_id: job for job in await scheduler.batch_jobs(run.id)}
+            self._launch(run)
+        if rows: LOGGER.info(f"Resuming {len(rows)} playlist batch(es).")
+
+    async def preview(self, link):
+        """Pages through a playlist's flat entries. Returns (title, entry count, estimated bytes), or None if it isn't a playlist."""
+        title, count, durations, start = None, 0, [], 1
+        while count < self.max_entries:
+            end = min(start + self.page_size - 1, self.max_entries)
+            page = await ytdlp_executor.extract_page(link, start, end)
+            if page is None: return None
+            title = title or page['title']
+            count += len(page['entries'])
+            durations.extend(entry['duration'] for entry in page['entries'] if entry['duration'])
+            if page['count']:
+                # The extractor knows the full length; the pages listed so far are enough for the size estimate.
+                count = min(page['count'], self.max_entries)
+                break
+            if len(page['entries']) < end - start + 1: break
+            start = end + 1
+        estimated_bytes = int(sum(durations) / len(durations) * count * BATCH_BYTES_PER_SECOND) if durations else None
+        return title or link, count, estimated_bytes
+
+    async def create(self, user_id, link, title, total, estimated_bytes, card):
+        """Records a batch awaiting confirmation on `card`; unconfirmed batches expire after CONFIRMATION_TTL."""
+        trace_id = trace_id_var.get()
+
+        def _insert(conn):
+            conn.execute("DELETE FROM batches WHERE state = 'pending' AND created_at < ?", (time.time() - CONFIRMATION_TTL,))
+            return conn.execute(
+                "INSERT INTO batches (user_id, link, title, status_message_id, total, estimated_bytes, trace_id, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, link, title, card.id, total, estimated_bytes, trace_id, time.time())
+            ).lastrowid
+        return await db.write(_insert)
+
+    async def confirm(self, batch_id, user_id, card):
+        """Starts a pending batch on its confirmation card. Returns False if it expired or was already started."""
+        started = await db.execute(
+            "UPDATE batches SET state = 'running', updated_at = CURRENT_TIMESTAMP WHERE id = ? AND user_id = ? AND state = 'pending' AND created_at > ?",
+            (batch_id, user_id, time.time() - CONFIRMATION_TTL)
+        )
+        if not started: return False
+        row = await db.fetchone("SELECT id, user_id, link, title, status_message_id, cursor, total, sent, failed, trace_id FROM batches WHERE id = ?", (batch_id,))
+        run = BatchRun(*row, status_message=card)
+        self._launch(run)
+        await self._edit_progress(run)
+        return True
+
+    async def discard(self, batch_id, user_id):
+        await db.execute("DELETE FROM batches WHERE id = ? AND user_id = ? AND state = 'pending'", (batch_id, user_id))
+
+    def _launch(self, run):
+        self._runs[run.id] = run
+        asyncio.create_task(self._run(run))
+
+    async def cancel(self, batch_id, user_id):
+        """Stops submitting entries and cancels every entry still queued or running."""
+        run = self._runs.get(batch_id)
+        if not run or run.user_id != user_id: return False
+        run.cancel_requested = True
+        for download_id, job in list(run.jobs.items()):
+            if await scheduler.cancel_queued(download_id):
+                try: await job.message.delete()
+                except Exception: pass
+            elif download_id in active_downloads:
+                await cancel_active_download(download_id)
+            elif await scheduler.request_cancel(download_id):
+                job.outcome = 'cancelled'
+        return True
+
+    async def _run(self, run):
+        trace_id_var.set(run.trace_id or new_trace_id())
+        slots = asyncio.Semaphore(self.lookahead)
+        tracking = set()
+
+        def track(job):
+            task = asyncio.create_task(self._track(run, job, slots))
+            tracking.add(task)
+            task.add_done_callback(tracking.discard)
+
+        try:
+            for job in list(run.jobs.values()):  # Entries submitted before a restart.
+                await slots.acquire()
+                track(job)
+            start = run.cursor + 1
+            while start <= run.total and not run.cancel_requested:
+                page = await ytdlp_executor.extract_page(run.link, start, min(start + self.page_size - 1, run.total))
+                entries = page['entries'] if page else []
+                if not entries:
+                    run.total = run.cursor  # The playlist got shorter since it was listed.
+                    break
+                for index, entry in enumerate(entries, start):
+                    await slots.acquire()
+                    if run.cancel_requested:
+                        slots.release()
+                        break
+                    track(await self._submit_entry(run, index, entry))
+                start += len(entries)
+            if tracking: await asyncio.gather(*tracking)
+        except Exception as e:
+            LOGGER.error(f"Batch {run.id} stopped unexpectedly: {e}", exc_info=True)
+            await self.cancel(run.id, run.user_id)
+            if tracking: await asyncio.gather(*tracking, return_exceptions=True)
+        finally:
+            state = 'cancelled' if run.cancel_requested else 'done'
+            await self._checkpoint(run, state)
+            self._runs.pop(run.id, None)
+
+        header = "🛑 **Batch Cancelled**" if run.cancel_requested else "✅ **Batch Complete!**"
+        try:
+            await run.status_message.edit_text(
+                f"{header}\n\n**📚** `{shorten(run.title or '', 60)}`\n\n- Sent: `{run.sent}`\n- Failed: `{run.failed}`\n- Total: `{run.total}`"
+            )
+        except Exception as e:
+            LOGGER.warning(f"Could not post batch {run.id} summary: {e}")
+        LOGGER.info(f"Batch {run.id} {state}: sent={run.sent} failed={run.failed} total={run.total}")
+
+    async def _submit_entry(self, run, index, entry):
+        title = entry['title'] or f"Video {index}"
+        media_key = media_key_for({'extractor_key': entry['ie_key'], 'id': entry['id']}, entry['url'])
+        estimated_bytes = int(entry['duration'] * BATCH_BYTES_PER_SECOND) if entry['duration'] else None
+        status_message = await app.send_message(run.user_id, f"⏳ `[{index}/{run.total}] Your download has been queued...`")
+        job = await scheduler.submit(
+            run.user_id, LinkData(entry['url'], title, entry['duration'] or 0, None, None, media_key, VIDEO_FORMAT, estimated_bytes, run.trace_id),
+            status_message, run.id
+        )
+        run.jobs[job.download_id] = job
+        run.cursor = index
+        await self._checkpoint(run)
+        return job
+
+    async def _track(self, run, job, slots):
+        try:
+            outcome = await scheduler.wait_finished(job)
+        finally:
+            run.jobs.pop(job.download_id, None)
+            slots.release()
+        if outcome in ('done', 'cached'): run.sent += 1
+        elif outcome != 'cancelled': run.failed += 1
+        await self._checkpoint(run)
+        await self._edit_progress(run)
+
+    async def _checkpoint(self, run, state='running'):
+        await db.execute(
+            "UPDATE batches SET state = ?, cursor = ?, total = ?, sent = ?, failed = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (state, run.cursor, run.total, run.sent, run.failed, run.id)
+        )
+
+    async def _edit_progress(self, run):
+        percentage = (run.done / run.total) * 100 if run.total else 0
+        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("🛑 Cancel Batch", callback_data=f"batch_cancel_{run.id}")]])
+        await status_updates.edit(
+            run.status_message,
+            f"📚 **Downloading Playlist...**\n\n**🏷️** `{shorten(run.title or '', 60)}`\n\n"
+            f"**Progress:** `{get_progress_bar(min(percentage, 100))} {percentage:.1f}%`\n"
+            f"- Sent: `{run.sent}`\n- Failed: `{run.failed}`\n- In Progress: `{len(run.jobs)}`\n- Total: `{run.total}`",
+            keyboard
+        )
+
+batch_engine = BatchEngine()
+
+@app.on_message(filters.command("batch") & filters.private & verified_user_filter & admission_filter)
+async def batch_command(client, message):
+    try:
+        await preview_batch(client, message)
+    finally:
+        admission.release(message.from_user.id)
+
+async def preview_batch(client, message):
+    if len(message.command) < 2 or not message.command[1].startswith(("http://", "https://")):
+        return await message.reply_text(
+            f"**📚 Playlist Download**\n\nSend `/batch <playlist or channel link>` to download up to `{BATCH_MAX_ENTRIES}` of its videos after a single confirmation.",
+            quote=True
+        )
+    link, user_id = message.command[1], message.from_user.id
+
+    trace_token = trace_id_var.set(new_trace_id())
+    card = await message.reply_text("🔎 `Listing playlist entries...`", quote=True)
+    try:
+        preview = await batch_engine.preview(link)
+        if not preview:
+            return await card.edit_text("🚫 **Not a playlist.** Send a single video as a plain link instead.")
+        title, total, estimated_bytes = preview
+        if not total:
+            return await card.edit_text("🚫 **Empty playlist:** no videos were found at this link.")
+        batch_id = await batch_engine.create(user_id, link, title, total, estimated_bytes, card)
+        keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton(f"✅ Download All ({total})", callback_data=f"batch_go_{batch_id}")],
+            [InlineKeyboardButton("❌ Cancel", callback_data=f"batch_no_{batch_id}")],
+        ])
+        size_text = f"~{humanbytes(estimated_bytes)}" if estimated_bytes else "Unknown"
+        limit_note = f" (first {BATCH_MAX_ENTRIES})" if total == BATCH_MAX_ENTRIES else ""
+        await card.edit_text(
+            f"**📚 Playlist:** `{shorten(title, 70)}`\n\n**🎞️ Videos:** `{total}`{limit_note}\n**💾 Est. Size:** `{size_text}`\n\nDownload all of them?",
+            reply_markup=keyboard
+        )
+    except Exception as e:
+        LOGGER.error(f"Error listing playlist {link}: {e}", exc_info=True)
+        metrics.inc("bot_errors_total", stage="extract", type=error_type(e), extractor=extractor_of(None, link))
+        await card.edit_text("🚫 **Error:** Failed to list the playlist. It might be invalid, private, or from an unsupported site.")
+    finally:
+        trace_id_var.reset(trace_token)
+
+@app.on_callback_query(filters.regex(r"^batch_(go|no|cancel)_\d+$"))
+async def batch_callback(client, callback_query):
+    _, action, batch_id = callback_query.data.split("_")
+    user_id, batch_id = callback_query.from_user.id, int(batch_id)
+
+    if action == "no":
+        await batch_engine.discard(batch_id, user_id)
+        await callback_query.message.delete()
+        return await callback_query.answer("Batch cancelled.")
+    if action == "go":
+        if await batch_engine.confirm(batch_id, user_id, callback_query.message):
+            return await callback_query.answer("Batch started.")
+        await callback_query.message.delete()
+        return await callback_query.answer("This batch confirmation has expired. Please send /batch again.", show_alert=True)
+    if await batch_engine.cancel(batch_id, user_id):
+        return await callback_query.answer("Stopping the batch...")
+    await callback_query.answer("This batch has already finished.", show_alert=True)
+
+# ============== BROADCAST ENGINE ========================================== #
+UNREACHABLE_USER_ERRORS = (UserIsBlocked, InputUserDeactivated, UserDeactivated, UserDeactivatedBan, PeerIdInvalid)
+
+@dataclass(eq=False)
+class BroadcastRun:
+    id: int
+    admin_id: int
+    from_chat_id: int
+    message_id: int
+    status_message_id: int
+    cursor: int = 0
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    blocked: int = 0
+    status_message: Message = None
+    cancel_requested: bool = False
+
+    @property
+    def done(self):
+        return self.sent + self.failed + self.blocked
+
+class BroadcastEngine:
+    """
+    Background broadcasts. Recipients are paged from the users table by user_id, so the
+    `cursor` saved with each checkpoint lets a restart resume where it stopped. A pool of
+    senders shares one token bucket sized for Telegram's global limit; each chat gets a
+    single message, so the per-chat limit is never the bottleneck. A FloodWait pauses the
+    whole bucket. Blocked and deactivated users are flagged and skipped from then on.
+    """
+    def __init__(self, rate=BROADCAST_RATE, concurrency=BROADCAST_CONCURRENCY):
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, rate)
+        self._runs = {}
+
+    def __len__(self):
+        return len(self._runs)
+
+    async def start(self):
+        rows = await db.fetchall(
+            "SELECT id, admin_id, from_chat_id, message_id, status_message_id, cursor, total, sent, failed, blocked "
+            "FROM broadcasts WHERE state = 'running' ORDER BY id"
+        )
+        for row in rows:
+            if row[0] in self._runs: continue
+            run = BroadcastRun(*row)
+            run.status_message = await restore_status_message(run.admin_id, run.status_message_id, "📢 `Resuming broadcast after a restart...`")
+            if run.status_message is None:
+                LOGGER.warning(f"Cancelling broadcast {run.id}: admin {run.admin_id} can't be reached.")
+                await db.execute("UPDATE broadcasts SET state = 'cancelled', updated_at = CURRENT_TIMESTAMP WHERE id = ?", (run.id,))
+                continue
+            self._launch(run)
+        if rows: LOGGER.info(f"Resuming {len(rows)} broadcast(s).")
+
+    async def submit(self, admin_id, message):
+        total = await db.fetchval("SELECT COUNT(*) FROM users WHERE is_banned = 0 AND is_blocked = 0", default=0)
+        status_message = await message.reply_text(f"📢 `Starting broadcast to {total} users...`")
+        broadcast_id = await db.write(lambda conn: conn.execute(
+            "INSERT INTO broadcasts (admin_id, from_chat_id, message_id, status_message_id, total) VALUES (?, ?, ?, ?, ?)",
+            (admin_id, message.chat.id, message.id, status_message.id, total)
+        ).lastrowid)
+        run = BroadcastRun(broadcast_id, admin_id, message.chat.id, message.id, status_message.id, total=total, status_message=status_message)
+        self._launch(run)
+        return run
+
+    def _launch(self, run):
+        self._runs[run.id] = run
+        asyncio.create_task(self._run(run))
+
+    def cancel(self, broadcast_id):
+        run = self._runs.get(broadcast_id)
+        if run: run.cancel_requested = True
+        return run is not None
+
+    async def _run(self, run):
+        recipients = asyncio.Queue(maxsize=self.concurrency * 2)
+        in_flight, unreachable = set(), []
+        last_dispatched = run.cursor
+
+        async def produce():
+            nonlocal last_dispatched
+            cursor = run.cursor
+            while not run.cancel_requested:
+                rows = await db.fetchall(
+                    "SELECT user_id FROM users WHERE user_id > ? AND is_banned = 0 AND is_blocked = 0 ORDER BY user_id LIMIT ?",
+                    (cursor, BROADCAST_PAGE_SIZE)
+                )
+                if not rows: break
+                for (user_id,) in rows:
+                    if run.cancel_requested: break
+                    in_flight.add(user_id)
+                    await recipients.put(user_id)
+                    last_dispatched = user_id
+                cursor = rows[-1][0]
+            for _ in range(self.concurrency): await recipients.put(None)
+
+        async def send():
+            while (user_id := await recipients.get()) is not None:
+                if not run.cancel_requested: await self._deliver(run, user_id, unreachable)
+                in_flight.discard(user_id)
+
+        async def checkpoint(state='running'):
+            # Everything below the lowest in-flight id has been handled.
+            run.cursor = min(in_flight) - 1 if in_flight else last_dispatched
+            blocked_now = unreachable[:]
+            unreachable.clear()
+
+            def _save(conn):
+                if blocked_now: conn.executemany("UPDATE users SET is_blocked = 1 WHERE user_id = ?", blocked_now)
+                conn.execute(
+                    "UPDATE broadcasts SET state = ?, cursor = ?, sent = ?, failed = ?, blocked = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                    (state, run.cursor, run.sent, run.failed, run.blocked, run.id)
+                )
+            await db.write(_save)
+
+        async def report():
+            while True:
+                await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+                await checkpoint()
+                await self._edit_progress(run)
+
+        reporter = asyncio.create_task(report())
+        try:
+            await asyncio.gather(produce(), *(send() for _ in range(self.concurrency)))
+        except Exception as e:
+            LOGGER.error(f"Broadcast {run.id} stopped unexpectedly: {e}", exc_info=True)
+        finally:
+            reporter.cancel()
+            state = 'cancelled' if run.cancel_requested else 'done'
+            await checkpoint(state)
+            self._runs.pop(run.id, None)
+
+        header = "🛑 **Broadcast Cancelled**" if run.cancel_requested else "✅ **Broadcast Complete!**"
+        try:
+            await run.status_message.edit_text(
+                f"{header}\n\n- Sent: `{run.sent}`\n- Blocked/Deactivated: `{run.blocked}`\n- Failed: `{run.failed}`"
+            )
+        except Exception as e:
+            LOGGER.warning(f"Could not post broadcast {run.id} summary: {e}")
+        LOGGER.info(f"Broadcast {run.id} {state}: sent={run.sent} blocked={run.blocked} failed={run.failed}")
+
+    async def _deliver(self, run, user_id, unreachable):
+        while True:
+            await self.bucket.acquire()
+            try:
+                await app.copy_message(user_id, run.from_chat_id, run.message_id)
+                run.sent += 1
+                return
+            except FloodWait as e:
+                LOGGER.warning(f"Broadcast {run.id} hit FloodWait, pausing senders for {e.value}s.")
+                self.bucket.pause(e.value)
+            except UNREACHABLE_USER_ERRORS:
+                run.blocked += 1
+                unreachable.append((user_id,))
+                return
+            except Exception as e:
+                run.failed += 1
+                LOGGER.error(f"Broadcast failed for user {user_id}: {e}")
+                return
+
+    async def _edit_progress(self, run):
+        percentage = (run.done / run.total) * 100 if run.total else 0
+        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("🛑 Cancel Broadcast", callback_data=f"admin_bccancel_{run.id}")]])
+        await status_updates.edit(
+            run.status_message,
+            f"📢 **Broadcasting...**\n\n**Progress:** `{get_progress_bar(min(percentage, 100))} {percentage:.1f}%`\n"
+            f"- Sent: `{run.sent}`\n- Blocked/Deactivated: `{run.blocked}`\n- Failed: `{run.failed}`\n- Total: `{run.total}`",
+            keyboard
+        )
+
+broadcast_engine = BroadcastEngine()
+
 # ============== ADMIN PANEL & ACTIONS ===================================== #
 @app.on_message(filters.command("admin") & filters.user(ADMINS))
 async def admin_panel(client, message):
@@ -371,18 +2946,54 @@ async def admin_panel(client, message):
         ])
     )
 
+def metrics_summary():
+    """Condensed view of the /metrics data for the Statistics panel."""
+    lines = ["**⏱️ Stage Latency** (avg / p95):"]
+    for stage in ("extract", "queue", "download", "merge", "thumbnail", "upload"):
+        count, mean, p95 = metrics.summary("bot_stage_seconds", stage=stage)
+        if count: lines.append(f"- {stage}: `{mean:.2f}s` / `≤{p95:g}s` ({count})")
+    if len(lines) == 1: lines.append("- no jobs measured yet")
+    _, db_mean, db_p95 = metrics.summary("bot_db_seconds")
+    _, lag_mean, lag_p95 = metrics.summary("bot_event_loop_lag_seconds")
+    lines.append(f"**🗄️ DB Calls:** `{db_mean * 1000:.1f}ms` avg, p95 `≤{db_p95 * 1000:g}ms`")
+    lines.append(f"**🐢 Loop Lag:** `{last_loop_lag * 1000:.1f}ms` now, `{lag_mean * 1000:.1f}ms` avg, p95 `≤{lag_p95 * 1000:g}ms`")
+    downloaded, uploaded = metrics.total("bot_bytes_total", direction="download"), metrics.total("bot_bytes_total", direction="upload")
+    lines.append(f"**📦 Transferred:** ⬇️ `{humanbytes(downloaded)}` ⬆️ `{humanbytes(uploaded)}`")
+    lines.append(f"**❗ Errors:** `{metrics.total('bot_errors_total'):g}`")
+    return "\n".join(lines)
+
 @app.on_callback_query(filters.regex("^admin_") & filters.user(ADMINS))
 async def admin_callbacks(client, cb):
     action = cb.data.split("_", 1)[1]
     back_button = InlineKeyboardButton("⬅️ Back to Menu", callback_data="admin_back")
     
     if action == "stats":
-        stats_text = f"**📊 Bot Statistics**\n\n👥 **Total Users:** `{get_total_users()}`\n⚡ **Active Downloads:** `{len(active_downloads)}`"
+        cached_files, cached_bytes = await media_cache.size()
+        stats_text = (
+            f"**📊 Bot Statistics**\n\n👥 **Total Users:** `{await get_total_users()}`\n⚡ **Active Downloads:** `{scheduler.active_count}`\n⏳ **Queued Jobs:** `{len(scheduler)}`\n\n"
+            f"**♻️ File Cache:** `{cached_files}` videos ({humanbytes(cached_bytes)}), `{media_cache.hits}` hits / `{media_cache.misses}` misses (`{media_cache.hit_rate:.1f}%`)\n"
+            f"**🧾 Metadata Cache:** `{len(metadata_cache)}` entries, `{metadata_cache.hits}` hits / `{metadata_cache.misses}` misses (`{metadata_cache.hit_rate:.1f}%`)\n"
+            f"**🗂️ User Cache:** `{len(user_status_cache)}` entries, `{user_status_cache.hits}` hits / `{user_status_cache.misses}` misses (`{user_status_cache.hit_rate:.1f}%`)\n"
+            f"**🪪 Pending Confirmations:** `{len(confirmations)}` in memory / `{await confirmations.stored()}` stored, `{confirmations.evictions}` evicted, "
+            f"`{confirmations.swept}` expired, `{confirmations.restored}` restored\n"
+            f"**📚 Playlist Batches:** `{len(batch_engine)}` running\n"
+            f"**🚦 Rate Limited:** `{metrics.total('bot_admission_rejections_total'):g}` link(s) dropped\n\n"
+            f"{metrics_summary()}"
+        )
         await cb.message.edit_text(stats_text, reply_markup=InlineKeyboardMarkup([[back_button]]))
     
     elif action == "sys":
         cpu, mem, disk = psutil.cpu_percent(interval=0.5), psutil.virtual_memory(), psutil.disk_usage('/')
         stats = f"**⚙️ System**\n\n**CPU:** `{cpu}%`\n**RAM:** `{mem.percent}%` ({humanbytes(mem.used)}/{humanbytes(mem.total)})\n**Disk:** `{disk.percent}%` ({humanbytes(disk.used)}/{humanbytes(disk.total)})"
+        download_usage = await asyncio.to_thread(storage.usage, storage.path)
+        stats += (
+            f"\n\n**📁 Downloads:** `{humanbytes(download_usage)}` used of `{humanbytes(storage.quota)}` quota"
+            f"\n**🔒 Reserved:** `{humanbytes(storage.reserved)}` for `{len(storage.reservations)}` job(s)"
+            f"\n**🧹 Swept:** `{storage.swept_files}` orphaned file(s), `{humanbytes(storage.swept_bytes)}`"
+        )
+        if storage.scratch_path:
+            scratch_usage, scratch_disk = await asyncio.to_thread(storage.usage, storage.scratch_path), psutil.disk_usage(storage.scratch_path)
+            stats += f"\n**⚡ Scratch:** `{humanbytes(scratch_usage)}` used, `{humanbytes(scratch_disk.free)}` free"
         await cb.message.edit_text(stats, reply_markup=InlineKeyboardMarkup([[back_button]]))
 
     elif action == "broadcast":
@@ -402,7 +3013,7 @@ async def admin_callbacks(client, cb):
     elif action == "toggle_bot":
         global BOT_IS_ACTIVE
         BOT_IS_ACTIVE = not BOT_IS_ACTIVE
-        set_bot_status(BOT_IS_ACTIVE)
+        await set_bot_status(BOT_IS_ACTIVE)
         await cb.answer(f"Bot has been turned {'ON' if BOT_IS_ACTIVE else 'OFF'}.", show_alert=True)
         await admin_panel(client, cb.message) # Refresh the panel
         
@@ -411,6 +3022,10 @@ async def admin_callbacks(client, cb):
         if os.path.exists(LOG_FILE): await client.send_document(cb.from_user.id, LOG_FILE, caption="Bot Log File")
         else: await client.send_message(cb.from_user.id, "Log file not found!")
     
+    elif action.startswith("bccancel_"):
+        if broadcast_engine.cancel(int(action.split("_", 1)[1])): return await cb.answer("Stopping the broadcast...")
+        return await cb.answer("This broadcast has already finished.", show_alert=True)
+
     elif action == "back":
         admin_states.pop(cb.from_user.id, None)
         await admin_panel(client, cb.message)
@@ -428,27 +3043,14 @@ async def admin_action_handler(client, message):
 
     admin_states.pop(admin_id, None)
     if state == "broadcast":
-        sent_count, failed_count = 0, 0
-        user_ids = get_all_user_ids()
-        await message.reply_text(f"📢 Broadcasting to `{len(user_ids)}` users... This may take a while.")
-        for user_id in user_ids:
-            try:
-                await message.copy(user_id)
-                sent_count += 1
-                await asyncio.sleep(0.1)
-            except (UserIsBlocked, InputUserDeactivated):
-                failed_count += 1
-            except Exception as e:
-                failed_count += 1
-                LOGGER.error(f"Broadcast failed for user {user_id}: {e}")
-        await message.reply_text(f"✅ **Broadcast Complete!**\n\n- Sent: `{sent_count}`\n- Failed (Blocked/Deactivated): `{failed_count}`")
+        await broadcast_engine.submit(admin_id, message)
 
     elif state in ["ban", "unban"]:
         if not message.text.isdigit():
             return await message.reply_text("Invalid User ID. Please provide a numeric ID.")
         user_id_to_modify = int(message.text)
         is_banning = state == "ban"
-        set_user_ban_status(user_id_to_modify, is_banning)
+        await set_user_ban_status(user_id_to_modify, is_banning)
         action_text = "banned" if is_banning else "unbanned"
         await message.reply_text(f"✅ User `{user_id_to_modify}` has been successfully **{action_text}**.")
         
@@ -463,16 +3065,77 @@ async def admin_action_handler(client, message):
             LOGGER.error(f"Could not notify user {user_id_to_modify} about status change: {e}")
 
 # ============================ MAIN EXECUTION ============================= #
+class StartupTimer:
+    """Durations of startup steps, logged as one breakdown line so slow starts show up in the log."""
+    def __init__(self, started=None):
+        self.started = started or time.perf_counter()
+        self.steps = []
+
+    @contextmanager
+    def step(self, name):
+        started = time.perf_counter()
+        try: yield
+        finally: self.steps.append((name, time.perf_counter() - started))
+
+    def summary(self):
+        total = time.perf_counter() - self.started
+        return f"{total:.2f}s (" + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.steps) + ")"
+
+async def warm_up():
+    """
+    Runs once the bot is already answering updates: loads what the first link would otherwise
+    wait for. Each step is best-effort, since everything here also happens lazily on first use.
+    """
+    timer = StartupTimer()
+    steps = (
+        ("imports", lambda: asyncio.to_thread(lambda: [importlib.import_module(name) for name in ("aiohttp", "psutil", "yt_dlp")])),
+        ("extractors", ytdlp_executor.warm_up),
+        ("http pool", get_http_session),
+        ("storage sweep", storage.sweep),
+    )
+    for name, run in steps:
+        try:
+            with timer.step(name): await run()
+        except Exception as e:
+            LOGGER.warning(f"Warm-up step '{name}' failed: {e}")
+    LOGGER.info(f"Warm-up finished in {timer.summary()}")
+
 async def main():
     global BOT_IS_ACTIVE
-    os.makedirs(DOWNLOAD_PATH, exist_ok=True)
-    init_db()
-    BOT_IS_ACTIVE = get_bot_status()
-    LOGGER.info(f"Bot starting... Initial status: {'ACTIVE' if BOT_IS_ACTIVE else 'INACTIVE'}")
-    await app.start()
-    LOGGER.info("Bot has started successfully!")
+    startup = StartupTimer(IMPORT_STARTED)
+    startup.steps.append(("imports", time.perf_counter() - IMPORT_STARTED))
+    with startup.step("database"):
+        for directory in storage.dirs: os.makedirs(directory, exist_ok=True)
+        db.open(init_db)
+        BOT_IS_ACTIVE = await get_bot_status()
+    LOGGER.info(f"Bot starting in {BOT_MODE} mode... Initial status: {'ACTIVE' if BOT_IS_ACTIVE else 'INACTIVE'}")
+    if BOT_MODE == "worker": LOGGER.info(f"Downloader worker id: {WORKER_ID}")
+    with startup.step("telegram"):
+        await app.start()
+    # Updates are served from here on; the rest of startup and the warm-up run alongside them.
+    warmup_task = asyncio.create_task(warm_up())
+    with startup.step("restore"):
+        status_updates.start()
+        await scheduler.start()
+        if BOT_MODE != "worker":
+            await broadcast_engine.start()
+            await batch_engine.start()
+            asyncio.create_task(confirmations.sweep_forever())
+    asyncio.create_task(storage.sweep_forever())
+    asyncio.create_task(monitor_event_loop())
+    with startup.step("metrics"):
+        try: metrics_runner = await start_metrics_server()
+        except OSError as e:
+            metrics_runner = None
+            LOGGER.warning(f"Metrics endpoint could not start on {METRICS_HOST}:{METRICS_PORT}: {e}")
+    LOGGER.info(f"Bot has started successfully! Startup took {startup.summary()}")
     await idle()
+    warmup_task.cancel()
     await app.stop()
+    if metrics_runner: await metrics_runner.cleanup()
+    await close_http_session()
+    await ytdlp_executor.shutdown()
+    db.close()
     LOGGER.info("Bot has been stopped.")
 
 if __name__ == "__main__":